@@ -0,0 +1,43 @@
+""" compares processing a batch of same sized synthetic receipts one image at a time against the batched processBatch
+    of the pre-processors which have one, checking the results are identical. 
+    The morphology stages have none: a single tall image of the stacked batch is no faster than the images one by one
+
+    usage: python -m benchmarks.batch [batch size (default 16)] [width (default 1200)]
+"""
+from preprocessing.Processors import Denoiser,Deskewer
+from benchmarks.synthetic import renderReceipt
+import numpy as np
+import cv2
+import sys
+import time
+
+def timed(f,*args):
+    start = time.perf_counter()
+    out = f(*args)
+    return out,time.perf_counter() - start
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1200
+
+    # the same number of items and no skew gives the same image size, the deskewer gets skewed (binarized) copies cut to that size
+    images = [renderReceipt(seed,10,width,0,8)[0] for seed in range(size)]
+    h,w = images[0].shape
+    skewed = [cv2.threshold(renderReceipt(seed,10,width,3 if seed % 2 == 0 else -3,0)[0][:h,:w],140,255,cv2.THRESH_BINARY)[1] for seed in range(size)]
+
+    stages = [
+        ("Denoiser",Denoiser(lo_intensity_thresh=140),images),
+        ("Deskewer",Deskewer(text_area_frac_threshold=0.03),skewed),
+    ]
+
+    print("batch of {} {}x{} images".format(size,w,h))
+    identical = True
+    for name,p,batch in stages:
+        single,single_t = timed(lambda: [p.process(img) for img in batch])
+        batched,batch_t = timed(p.processBatch,np.stack(batch))
+        same = all(np.array_equal(a,b) for a,b in zip(single,batched))
+        identical = identical and same
+        print("{:<20} {:>8.1f}ms one at a time, {:>8.1f}ms batched {}".format(name,single_t * 1000,batch_t * 1000,"identical" if same else "DIFFERENT"))
+
+    if not identical:
+        sys.exit(1)
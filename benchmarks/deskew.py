@@ -0,0 +1,89 @@
+""" compares the skew angles and time of Deskewer's estimation at several downsampling scales against the full resolution estimate 
+    of the original implementation, on the given image rotated by a range of angles and on synthetic receipts skewed by the same angles. 
+    The image is binarized first, as the Denoiser does in the default pipeline.
+    Exits with 1 if the full resolution angles differ from the original, or if the error of a reduced scale against the applied rotation 
+    is more than tolerance degrees worse than the error of the original
+
+    usage: python -m benchmarks.deskew [path-to-img (default examples/receipt-0002.png)] [scales (default 1,0.5,0.25)] [tolerance (default 1.0)]
+"""
+from preprocessing.Processors import Deskewer
+from benchmarks.synthetic import renderReceipt
+import cv2
+import sys
+import time
+
+def originalSkewAngle(deskewer,cvImage):
+    """ the original full resolution estimate, copying the image and sorting the contours """
+    newImage = cvImage.copy()
+    img_area = cvImage.shape[:2][0] * cvImage.shape[:2][1]
+    blur = cv2.GaussianBlur(newImage, (9, 9), 0)
+    thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (30, 5))
+    dilate = cv2.dilate(thresh, kernel, iterations=5)
+    contours, hierarchy = cv2.findContours(dilate, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    contours = sorted(contours, key = cv2.contourArea, reverse = True)
+
+    max_skew_ang_abs = 0
+    max_skew_ang = 0
+    for c in contours:
+        minAreaRect = cv2.minAreaRect(c)
+        area = minAreaRect[1][0] * minAreaRect[1][1]
+        if area < deskewer.text_area_frac_threshold * img_area:
+            continue
+        angle = deskewer.determine_rot_angle_from_rot_box(minAreaRect)
+        if abs(angle) > max_skew_ang_abs:
+            max_skew_ang_abs = abs(angle)
+            max_skew_ang = angle
+    return max_skew_ang
+
+def rotated(img,angle):
+    (h,w) = img.shape[:2]
+    M = cv2.getRotationMatrix2D((w / 2,h / 2),angle,1.0)
+    return cv2.warpAffine(img,M,(w,h),flags=cv2.INTER_CUBIC,borderMode=cv2.BORDER_CONSTANT,borderValue=255)
+
+def timed(f,*args):
+    start = time.perf_counter()
+    out = f(*args)
+    return out,time.perf_counter() - start
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "examples/receipt-0002.png"
+    scales = [float(s) for s in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1.0,0.5,0.25]
+    tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    img = cv2.threshold(cv2.imread(path,0),140,255,cv2.THRESH_BINARY)[1]
+
+    rotations = [-10,-5,-2,0,2,5,10]
+    images = [("image",a,rotated(img,a)) for a in rotations] + [("synthetic",a,renderReceipt(0,10,1200,a,0)[0]) for a in rotations]
+    print("{:>10} {:>8} {:>10}".format("input","rotation","original") + "".join(["{:>16}".format("scale " + str(s)) for s in scales]))
+
+    total_original = 0
+    totals = [0] * len(scales)
+    max_diffs = [0] * len(scales)
+    # how much further from the applied rotation each scale's estimate got than the original's, at worst
+    max_excess = [0] * len(scales)
+    for (name,a,image) in images:
+        reference,t = timed(originalSkewAngle,Deskewer(text_area_frac_threshold=0.01),image)
+        total_original += t
+        row = "{:>10} {:>8} {:>10.2f}".format(name,a,reference)
+        for i,s in enumerate(scales):
+            angle,t = timed(Deskewer(text_area_frac_threshold=0.01,estimation_scale=s).getSkewAngle,image)
+            totals[i] += t
+            max_diffs[i] = max(max_diffs[i],abs(angle - reference))
+            max_excess[i] = max(max_excess[i],abs(angle - a) - abs(reference - a))
+            row += "{:>16.2f}".format(angle)
+        print(row)
+
+    print("{:>19} {:>9.1f}ms".format("time",total_original * 1000 / len(images)) + "".join(["{:>14.1f}ms".format(t * 1000 / len(images)) for t in totals]))
+    print("{:>19} {:>10}".format("max diff","") + "".join(["{:>16.2f}".format(d) for d in max_diffs]))
+    print("{:>19} {:>10}".format("max extra error","") + "".join(["{:>16.2f}".format(d) for d in max_excess]))
+
+    failed = False
+    if 1.0 in scales and max_diffs[scales.index(1.0)] != 0:
+        print("full resolution angles differ from the original implementation")
+        failed = True
+    for s,excess in zip(scales,max_excess):
+        if excess > tolerance:
+            print("scale {} is up to {:.2f} degrees further from the applied rotation than the original, over the tolerance of {}".format(s,excess,tolerance))
+            failed = True
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,119 @@
+""" compares the analytics mode metric as it used to be computed (dynamic programming edit distance, 
+    greedy matching recomputing distances) with evaluation.Metrics on randomly corrupted copies of the example labels,
+    checks the normalized errors are identical and prints the time taken by both
+
+    usage: python -m benchmarks.evaluation [receipts (default 200)] [items per receipt (default 30)]
+"""
+from evaluation.Metrics import evaluateReceipt,jsonLeafStrings,normalizedError
+import numpy as np
+import random
+import math
+import json
+import sys
+import time
+
+def dpWordDistance(seq1,seq2):
+    size_x = len(seq1) + 1
+    size_y = len(seq2) + 1
+    matrix = np.zeros ((size_x, size_y))
+    for x in range(size_x):
+        matrix [x, 0] = x
+    for y in range(size_y):
+        matrix [0, y] = y
+
+    for x in range(1, size_x):
+        for y in range(1, size_y):
+            cost = 0 if seq1[x-1] == seq2[y-1] else 1
+            matrix [x,y] = min(matrix[x-1, y] + 1,matrix[x-1, y-1] + cost,matrix[x, y-1] + 1)
+    return (matrix[size_x - 1, size_y - 1])
+
+def previousEvaluateReceipt(label_data,output_data):
+    """ the metric as analyzeResults computed it before evaluation.Metrics """
+    dist = sum(dpWordDistance(label_data[f],output_data[f]) for f in ["day","month","year","total_whole_part","total_fractional_part"])
+
+    assignment = []
+    assigned = set()
+    for correct in label_data["items"]:
+        min_output = None
+        min_distance = math.inf
+        for output in output_data["items"]:
+            if output["name"] in assigned:
+                continue 
+            distance = dpWordDistance(correct["name"],output["name"])
+            if distance < min_distance:
+                min_output = output
+                min_distance = distance
+        if min_output is not None:
+            assigned.add(min_output["name"])
+        assignment.append((correct,min_output))
+
+    for label,output in assignment:
+        if output is not None:
+            dist += dpWordDistance(label["name"],output["name"])
+            dist += dpWordDistance(label["price_whole_part"],output["price_whole_part"])
+            dist += dpWordDistance(label["price_fractional_part"],output["price_fractional_part"])
+        else:
+            dist += len(label["name"]) + len(label["price_whole_part"]) + len(label["price_fractional_part"])
+
+    for item in output_data["items"]:
+        if item["name"] not in assigned:
+            dist += len(item["name"] or "") + len(item["price_whole_part"] or "") + len(item["price_fractional_part"] or "")
+
+    chars = sum([len(x) for x in jsonLeafStrings(label_data,[])])
+    return normalizedError(dist,chars)
+
+def corrupt(text,rng):
+    """ randomly substitutes, drops and inserts characters like a noisy OCR would """
+    out = []
+    for c in text:
+        r = rng.random()
+        if r < 0.05:
+            continue
+        elif r < 0.12:
+            out.append(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789.~}"))
+        else:
+            out.append(c)
+        if rng.random() < 0.03:
+            out.append(rng.choice("il1. "))
+    return "".join(out)
+
+def randomReceiptPair(example,n_items,rng):
+    names = [i["name"] for i in example["items"]]
+    label = dict(example)
+    label["items"] = [{"name":rng.choice(names) + " " + str(rng.randint(0,99)),
+        "price_whole_part":str(rng.randint(0,20)),"price_fractional_part":"{:02d}".format(rng.randint(0,99))} for _ in range(n_items)]
+
+    output = {k:corrupt(v,rng) for k,v in label.items() if k != "items"}
+    output["items"] = [{k:corrupt(v,rng) for k,v in i.items()} for i in label["items"] if rng.random() > 0.1]
+    rng.shuffle(output["items"])
+    return label,output
+
+if __name__ == "__main__":
+    n_receipts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_items = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    rng = random.Random(0)
+    example = json.load(open("examples/receipt-0002.json"))
+    receipts = [randomReceiptPair(example,n_items,rng) for _ in range(n_receipts)]
+
+    start = time.perf_counter()
+    previous = [previousEvaluateReceipt(l,o) for (l,o) in receipts]
+    previous_t = time.perf_counter() - start
+
+    start = time.perf_counter()
+    greedy = [evaluateReceipt(l,o)["normalized_total_error"] for (l,o) in receipts]
+    greedy_t = time.perf_counter() - start
+
+    start = time.perf_counter()
+    optimal = [evaluateReceipt(l,o,"optimal")["normalized_total_error"] for (l,o) in receipts]
+    optimal_t = time.perf_counter() - start
+
+    print("receipts: {}, items per receipt: {}".format(n_receipts,n_items))
+    print("previous: {:.3f}s".format(previous_t))
+    print("greedy:   {:.3f}s ({:.1f}x)".format(greedy_t,previous_t / greedy_t))
+    print("optimal:  {:.3f}s ({:.1f}x)".format(optimal_t,previous_t / optimal_t))
+    print("mean normalized error, greedy: {:.4f} optimal: {:.4f}".format(np.mean(greedy),np.mean(optimal)))
+
+    if previous != greedy:
+        print("greedy normalized errors differ from the previous implementation")
+        sys.exit(1)
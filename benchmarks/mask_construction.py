@@ -0,0 +1,67 @@
+""" compares the per box mask construction ArtifactRemover used to do with the current one on random boxes,
+    checks the outputs are identical and prints how both scale with the number of boxes
+
+    usage: python -m benchmarks.mask_construction [height (default 3000)] [width (default 1200)]
+"""
+from preprocessing.Processors import ArtifactRemover
+from ocr.Engines import PytesseractEngine
+from classes.Classes import OcrResult
+import numpy as np
+import cv2
+import sys
+import time
+
+def perBoxRemoveArtifacts(remover,img,ocr_result):
+    """ the original implementation, allocating a full size mask per box """
+    d = ocr_result.data
+    total_mask = np.zeros(img.shape,np.uint8)
+    img_area = img.shape[0] * img.shape[1]
+
+    for i in range(len(d['level'])):
+        (x, y, w, h) = (d['left'][i], d['top'][i], d['width'][i], d['height'][i])    
+        area = w*h
+        if area < remover.text_area_frac_threshold_lo * img_area or area > remover.text_area_frac_threshold_hi * img_area:
+            continue
+
+        mask = np.zeros(img.shape,np.uint8)
+        mask = cv2.rectangle(mask,(x,y),(x+w,y+h),(255),thickness=cv2.FILLED)
+        total_mask = cv2.bitwise_or(total_mask,mask)
+
+    n_img = cv2.bitwise_and(img,total_mask)
+    bg = 255 - total_mask
+    return cv2.bitwise_or(n_img,bg) 
+
+def randomOcrResult(rng,n_boxes,shape):
+    """ random word sized boxes plus one page sized box, some sticking out of the image """
+    (h,w) = shape
+    data = {
+        "level":[1] + [5] * n_boxes,
+        "left":[0] + rng.integers(-10,w,n_boxes).tolist(),
+        "top":[0] + rng.integers(-10,h,n_boxes).tolist(),
+        "width":[w] + rng.integers(1,120,n_boxes).tolist(),
+        "height":[h] + rng.integers(1,40,n_boxes).tolist(),
+    }
+    return OcrResult(data)
+
+def timeCall(f,*args):
+    start = time.perf_counter()
+    out = f(*args)
+    return time.perf_counter() - start,out
+
+if __name__ == "__main__":
+    shape = (int(sys.argv[1]) if len(sys.argv) > 1 else 3000,int(sys.argv[2]) if len(sys.argv) > 2 else 1200)
+    rng = np.random.default_rng(0)
+    img = rng.integers(0,256,shape,dtype=np.uint8)
+    remover = ArtifactRemover(text_area_frac_threshold_lo=0.0001,text_area_frac_threshold_hi=0.6,engine=PytesseractEngine())
+
+    print("image: {}x{}".format(shape[1],shape[0]))
+    print("{:>8} {:>12} {:>12}".format("boxes","per box ms","current ms"))
+    for n_boxes in [10,100,1000,5000]:
+        ocr_result = randomOcrResult(rng,n_boxes,shape)
+        old_t,old_out = timeCall(perBoxRemoveArtifacts,remover,img,ocr_result)
+        new_t,new_out = timeCall(remover.removeArtifacts,img,ocr_result)
+
+        if not np.array_equal(old_out,new_out):
+            print("outputs differ for {} boxes".format(n_boxes))
+            sys.exit(1)
+        print("{:>8} {:>12.1f} {:>12.1f}".format(n_boxes,old_t * 1000,new_t * 1000))
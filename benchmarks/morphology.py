@@ -0,0 +1,54 @@
+""" checks MorphologyPipeline produces pixel identical output to running its Dilater/Eroder stages one by one 
+    and compares their times, on the example image (binarized as the Denoiser would) and random noise
+
+    usage: python -m benchmarks.morphology [path-to-img (default examples/receipt-0002.png)] [repeats (default 20)]
+"""
+from preprocessing.Processors import Dilater,Eroder,MorphologyPipeline
+import numpy as np
+import cv2
+import sys
+import time
+
+CHAINS = [
+    # the default pipeline of receipt_parser.py
+    [Dilater(iterations=2,kernel_shape=(2,2)),Eroder(iterations=2,kernel_shape=(2,2)),Dilater(iterations=2,kernel_shape=(2,2))],
+    [Eroder(iterations=1,kernel_shape=(3,3)),Dilater(iterations=1,kernel_shape=(3,3))],
+    [Dilater(iterations=1,kernel_shape=(2,2)),Dilater(iterations=2,kernel_shape=(2,2)),Eroder(iterations=1,kernel_shape=(3,2))],
+    [Eroder(iterations=3,kernel_shape=(1,3)),Eroder(iterations=1,kernel_shape=(1,3)),Dilater(iterations=4,kernel_shape=(1,3)),Dilater(iterations=1,kernel_shape=(5,5))],
+]
+
+def timed(f,img,repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = f(img)
+    return out,(time.perf_counter() - start) / repeats
+
+def runChain(chain):
+    def run(img):
+        for p in chain:
+            img = p.process(img)
+        return img
+    return run
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "examples/receipt-0002.png"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    images = {
+        "example":cv2.threshold(cv2.imread(path,0),140,255,cv2.THRESH_BINARY)[1],
+        "noise":np.random.default_rng(0).integers(0,256,(3000,1200),dtype=np.uint8),
+    }
+
+    identical = True
+    for name,img in images.items():
+        for chain in CHAINS:
+            fused = MorphologyPipeline(chain)
+            expected,chain_t = timed(runChain(chain),img,repeats)
+            out,fused_t = timed(fused.process,img,repeats)
+            same = np.array_equal(expected,out)
+            identical = identical and same
+            print("{:<8} {:>2} stages -> {} passes: {:>7.2f}ms -> {:>7.2f}ms {}".format(
+                name,len(chain),len(fused.plan),chain_t * 1000,fused_t * 1000,"identical" if same else "DIFFERENT"))
+
+    if not identical:
+        sys.exit(1)
@@ -0,0 +1,45 @@
+""" compares the wall time of the default pipeline with and without reusing the ArtifactRemover OCR pass in the parser
+
+    usage: python -m benchmarks.ocr_reuse [path-to-img-dir (default examples)] [repeats (default 3)]
+"""
+from receipt_parser import buildPipeline
+from output.Printers import JsonPrinter
+import cv2
+import sys
+import os
+import io
+import time
+
+def timePipeline(pipeline,images,repeats):
+    """ returns the mean seconds per image and the json output for each image """
+    printer = JsonPrinter()
+    outputs = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        outputs = []
+        for img in images:
+            _,receipt = pipeline.run(img)
+            out = io.StringIO()
+            printer.printOutput(receipt,out)
+            outputs.append(out.getvalue())
+
+    return (time.perf_counter() - start) / (repeats * len(images)),outputs
+
+if __name__ == "__main__":
+    dir = sys.argv[1] if len(sys.argv) > 1 else "examples"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    paths = sorted([os.path.join(dir,f) for f in os.listdir(dir) if os.path.splitext(f)[1].lower() in (".png",".jpg",".jpeg",".tif",".tiff")])
+    images = [cv2.imread(p,0) for p in paths]
+
+    two_pass,two_pass_out = timePipeline(buildPipeline({"reuse_ocr":False}),images,repeats)
+    one_pass,one_pass_out = timePipeline(buildPipeline({"reuse_ocr":True}),images,repeats)
+
+    print("images: {}, repeats: {}".format(len(images),repeats))
+    print("two OCR passes: {:.3f}s per image".format(two_pass))
+    print("one OCR pass:   {:.3f}s per image".format(one_pass))
+    print("speedup: {:.2f}x".format(two_pass / one_pass))
+
+    for p,a,b in zip(paths,two_pass_out,one_pass_out):
+        if a != b:
+            print("output differs for: " + p)
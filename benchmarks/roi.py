@@ -0,0 +1,41 @@
+""" places the example receipt on a larger dark background (like a phone capture or a scan of the whole scanner bed),
+    checks RoiCropper's crop contains the receipt and compares the time of the denoiser on the full and cropped frames
+
+    usage: python -m benchmarks.roi [path-to-img (default examples/receipt-0002.png)] [background scale (default 3)]
+"""
+from preprocessing.Processors import RoiCropper,Denoiser
+import numpy as np
+import cv2
+import sys
+import time
+
+def timed(f,*args):
+    start = time.perf_counter()
+    out = f(*args)
+    return out,time.perf_counter() - start
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "examples/receipt-0002.png"
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    receipt = cv2.imread(path,cv2.IMREAD_GRAYSCALE)
+    h,w = receipt.shape
+    frame = np.random.default_rng(0).normal(70,15,(int(h * scale),int(w * scale))).clip(0,255).astype(np.uint8)
+    y,x = (frame.shape[0] - h) // 3,(frame.shape[1] - w) // 2
+    frame[y:y + h,x:x + w] = receipt
+
+    cropper = RoiCropper()
+    cropped,crop_t = timed(cropper.process,frame)
+    x0,y0,x1,y1 = cropper.roi
+    contained = x0 <= x and y0 <= y and x1 >= x + w and y1 >= y + h
+    print("frame {}x{}, receipt at ({},{})-({},{}), cropped to ({},{})-({},{}) in {:.2f}ms, {:.0f}% of the pixels left {}".format(
+        frame.shape[1],frame.shape[0],x,y,x + w,y + h,x0,y0,x1,y1,crop_t * 1000,100 * cropped.size / frame.size,
+        "" if contained else "(RECEIPT CUT OFF)"))
+
+    denoiser = Denoiser(lo_intensity_thresh=140)
+    full_out,full_t = timed(denoiser.process,frame)
+    crop_out,cropped_t = timed(denoiser.process,cropped)
+    print("denoiser: {:.2f}s on the full frame, {:.2f}s on the crop".format(full_t,cropped_t))
+
+    if not contained:
+        sys.exit(1)
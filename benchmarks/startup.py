@@ -0,0 +1,104 @@
+""" measures the cold start of the CLI in fresh interpreters (with python -X importtime): the import time of receipt_parser, 
+    and the time spent importing modules during a single receipt run on the example image, lazily imported ones included. 
+    Lists the slowest imported modules and exits with 1 if the median of either exceeds its budget, 
+    or if the single receipt run imports any module it has no use for (see UNNEEDED), which would slip under a budget on a fast machine.
+    The single receipt run stops at its first OCR call (so it runs without tesseract), after the pipeline is built, 
+    the image loaded and the first pre-processors run, so it covers what a single file job imports
+
+    usage: python -m benchmarks.startup [--runs 10] [--budget-ms 150] [--single-budget-ms 250] [--top 10] [path-to-img (default examples/receipt-0002.png)]
+"""
+from receipt_parser import popOption
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+def importTimes(args):
+    """ runs python with the arguments in a fresh interpreter, returns the cumulative import time in microseconds of every module it loaded 
+        and the total time spent importing (in ms)
+    """
+    proc = subprocess.run([sys.executable,"-X","importtime"] + args,capture_output=True,text=True,check=True)
+    times = {}
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # self time | cumulative time | module name, indented under the module which imported it
+        _,cumulative,name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+        if not name[1:].startswith(" "):
+            total += int(cumulative)
+    return times,total / 1000
+
+# modules only some modes use, which a single receipt run (with the default engine) should never import
+UNNEEDED = ["pytesseract","PIL","matplotlib","pyarrow","http.server","service.Servers","calibration.Sweeps","pipeline.AsyncPipelines"]
+
+# a single file run of the CLI up to the OCR, the engine is swapped for one which stops the run
+SINGLE_FILE = """
+import sys,runpy
+import ocr.Engines
+class Stop(Exception):
+    pass
+class StopEngine(ocr.Engines.OcrEngine):
+    def imageToString(self,img,lang="eng",config=""):
+        raise Stop()
+    def imageToData(self,img,lang="eng",config=""):
+        raise Stop()
+ocr.Engines.default_engine = StopEngine()
+sys.argv = ["receipt_parser.py",sys.argv[1],sys.argv[2]]
+try:
+    runpy.run_path("receipt_parser.py",run_name="__main__")
+except Stop:
+    pass
+"""
+
+def singleFileRun(path,out_path):
+    """ the import times (see importTimes) and wall clock seconds of a single receipt run up to its OCR """
+    start = time.perf_counter()
+    times,total = importTimes(["-c",SINGLE_FILE,path,out_path])
+    return times,total,time.perf_counter() - start
+
+if __name__ == "__main__":
+    runs = int(popOption(sys.argv,"--runs",10))
+    budget_ms = float(popOption(sys.argv,"--budget-ms",150))
+    single_budget_ms = float(popOption(sys.argv,"--single-budget-ms",250))
+    top = int(popOption(sys.argv,"--top",10))
+    path = sys.argv[1] if len(sys.argv) > 1 else "examples/receipt-0002.png"
+
+    imports = [importTimes(["-c","import receipt_parser"])[0] for _ in range(runs)]
+    totals = [t["receipt_parser"] / 1000 for t in imports]
+    with tempfile.TemporaryDirectory() as tmp:
+        single = [singleFileRun(path,os.path.join(tmp,"out.json")) for _ in range(runs)]
+    single_imports = [t for (t,_,_) in single]
+    single_totals = [total for (_,total,_) in single]
+
+    print("import receipt_parser: median {:.1f}ms, min {:.1f}ms, max {:.1f}ms".format(statistics.median(totals),min(totals),max(totals)))
+    print("single file run (up to OCR): median {:.1f}ms importing, {:.1f}ms wall clock".format(statistics.median(single_totals),statistics.median(s * 1000 for (_,_,s) in single)))
+
+    for title,runs_imports,exclude in [("import receipt_parser",imports,"receipt_parser"),("single file run",single_imports,None)]:
+        # the slowest modules by median cumulative time, excluding the module measured itself
+        names = set(runs_imports[0]) - {exclude}
+        slowest = sorted(names,key=lambda n: -statistics.median(t.get(n,0) for t in runs_imports))[:top]
+        print("slowest imports of {} (cumulative):".format(title))
+        for name in slowest:
+            print("  {:<40} {:.1f}ms".format(name,statistics.median(t.get(name,0) for t in runs_imports) / 1000))
+
+    for heavy in ["numpy","cv2"]:
+        if heavy in imports[0]:
+            print("note: {} is imported by receipt_parser".format(heavy))
+
+    failed = False
+    unneeded = [m for m in UNNEEDED if m in single_imports[0]]
+    if len(unneeded) > 0:
+        print("the single file run imports modules it doesn't use: " + ", ".join(unneeded))
+        failed = True
+    if statistics.median(totals) > budget_ms:
+        print("import time over the budget of {:.0f}ms".format(budget_ms))
+        failed = True
+    if statistics.median(single_totals) > single_budget_ms:
+        print("import time of the single file run over the budget of {:.0f}ms".format(single_budget_ms))
+        failed = True
+    if failed:
+        sys.exit(1)
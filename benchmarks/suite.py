@@ -0,0 +1,106 @@
+""" benchmarks the default pipeline on synthetic receipts (see benchmarks.synthetic) across image sizes, 
+    measuring the end to end and per stage time, the peak memory and the analytics mode error of each size.
+    Results are written as json and can be compared against a saved baseline, exiting with 1 if any size got slower or less accurate
+
+    usage: python -m benchmarks.suite [--sizes 600,1200,2400] [--receipts 5] [--items 10] [--skew 2] [--noise 8] [--background INTENSITY]
+                                      [--reuse-ocr] [--adaptive-denoise] [--output results.json] [--baseline baseline.json] [--tolerance 0.2] [--error-tolerance 0.02]
+    --tolerance is the allowed relative slowdown of the mean time per receipt, --error-tolerance the allowed increase of the mean normalized error
+"""
+from receipt_parser import buildPipeline,popOption
+from benchmarks.synthetic import renderReceipt
+from output.Printers import JsonPrinter
+from evaluation.Metrics import evaluateReceipt
+from profiling.Profilers import Profiler,summarize
+import json
+import sys
+import time
+
+def benchmarkSize(pipeline,width,config):
+    """ runs the pipeline on config["receipts"] synthetic receipts of the given width, returns the result dictionary of the size """
+    printer = JsonPrinter()
+    profiler = Profiler(track_memory=True)
+    errors = []
+    seconds = 0
+    decisions = {}
+
+    with profiler.activated():
+        for seed in range(config["receipts"]):
+            img,label = renderReceipt(seed,config["items"],width,config["skew"] if seed % 2 == 0 else -config["skew"],config["noise"],config["background"])
+            start = time.perf_counter()
+            with profiler.stage("receipt"):
+                _,receipt = pipeline.run(img)
+            seconds += time.perf_counter() - start
+            for key,value in pipeline.last_report.items():
+                if isinstance(value,str):
+                    decisions[key + ":" + value] = decisions.get(key + ":" + value,0) + 1
+            errors.append(evaluateReceipt(label,printer.toDict(receipt))["normalized_total_error"])
+
+    # the per stage records include the memory tracing overhead, the end to end time is what the receipts took
+    stages = {s["stage"]:{"mean_wall":s["mean_wall"],"mean_cpu":s["mean_cpu"],"peak_memory":s["peak_memory"]} for s in summarize(profiler.records)}
+    return {
+        "width":width,
+        "receipts":config["receipts"],
+        "mean_seconds":seconds / config["receipts"],
+        "receipts_per_second":config["receipts"] / seconds if seconds > 0 else 0,
+        "peak_memory":stages.pop("receipt")["peak_memory"],
+        "mean_error":sum(errors) / len(errors),
+        "decisions":decisions,
+        "stages":stages
+    }
+
+def compare(results,baseline,tolerance,error_tolerance):
+    """ prints the change of each size against the baseline, returns the list of sizes which regressed """
+    base = {r["width"]:r for r in baseline["results"]}
+    regressions = []
+    for r in results["results"]:
+        b = base.get(r["width"])
+        if b is None:
+            continue
+        slowdown = r["mean_seconds"] / b["mean_seconds"] - 1 if b["mean_seconds"] > 0 else 0
+        error_change = r["mean_error"] - b["mean_error"]
+        regressed = slowdown > tolerance or error_change > error_tolerance
+        if regressed:
+            regressions.append(r["width"])
+        print("{:>6}px vs baseline: {:>+7.1%} time, {:>+.4f} error {}".format(r["width"],slowdown,error_change,"REGRESSION" if regressed else ""))
+    return regressions
+
+if __name__ == "__main__":
+    sizes = [int(s) for s in popOption(sys.argv,"--sizes","600,1200,2400").split(",")]
+    background = popOption(sys.argv,"--background")
+    config = {
+        "receipts":int(popOption(sys.argv,"--receipts",5)),
+        "items":int(popOption(sys.argv,"--items",10)),
+        "skew":float(popOption(sys.argv,"--skew",2)),
+        "noise":float(popOption(sys.argv,"--noise",8)),
+        "background":int(background) if background is not None else None,
+        "reuse_ocr":"--reuse-ocr" in sys.argv,
+        "adaptive_denoise":"--adaptive-denoise" in sys.argv,
+    }
+    output = popOption(sys.argv,"--output")
+    baseline = popOption(sys.argv,"--baseline")
+    tolerance = float(popOption(sys.argv,"--tolerance",0.2))
+    error_tolerance = float(popOption(sys.argv,"--error-tolerance",0.02))
+
+    pipeline = buildPipeline({"reuse_ocr":config["reuse_ocr"],"adaptive_denoise":config["adaptive_denoise"]})
+    results = {"config":config,"fingerprint":pipeline.fingerprint(),"results":[]}
+    for width in sizes:
+        r = benchmarkSize(pipeline,width,config)
+        results["results"].append(r)
+        print("{:>6}px: {:.3f}s per receipt, {:.2f} receipts/s, peak memory {:.1f}MB, mean error {:.4f}".format(
+            width,r["mean_seconds"],r["receipts_per_second"],r["peak_memory"] / 1024 ** 2,r["mean_error"]))
+        if len(r["decisions"]) > 0:
+            print("    decisions: " + ", ".join("{} x{}".format(k,v) for k,v in sorted(r["decisions"].items())))
+        for name,s in r["stages"].items():
+            print("    {:<28} {:>9.4f}s".format(name,s["mean_wall"]))
+
+    if output is not None:
+        with open(output,"w") as f:
+            json.dump(results,f,indent=4)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+        if baseline_results.get("config") != config:
+            print("warning: the baseline was run with different settings: " + json.dumps(baseline_results.get("config")))
+        if len(compare(results,baseline_results,tolerance,error_tolerance)) > 0:
+            sys.exit(1)
@@ -0,0 +1,103 @@
+""" renders synthetic receipts with OpenCV text drawing along with their expected output in the JsonPrinter format,
+    for benchmarking and calibrating the pipeline without hand labelled scans
+
+    usage: python -m benchmarks.synthetic output-dir [count (default 10)] [width (default 1200)] [items (default 10)] [skew degrees (default 2)] [noise (default 8)]
+    writes <output-dir>/images/synthetic-<i>.png and <output-dir>/labels/synthetic-<i>.json, ready for analytics mode
+"""
+import numpy as np
+import cv2
+import json
+import os
+import random
+import sys
+
+WORDS = ["milk","bread","eggs","butter","cheese","apples","bananas","pizza","pasta","rice","beans","coffee","tea","juice",
+    "water","chicken","beef","salad","tomatoes","onions","crisps","cereal","yoghurt","soup","flour","sugar","honey","jam"]
+
+def receiptContents(rng,item_count):
+    """ returns the text lines of a random receipt and its label in the JsonPrinter format """
+    items = []
+    for _ in range(item_count):
+        name = " ".join(rng.sample(WORDS,rng.randint(1,2)))
+        items.append({"name":name,"price_whole_part":str(rng.randint(0,19)),"price_fractional_part":"{:02d}".format(rng.randint(0,99))})
+
+    total = sum(int(i["price_whole_part"]) * 100 + int(i["price_fractional_part"]) for i in items)
+    day,month,year = str(rng.randint(1,28)),str(rng.randint(1,12)),str(rng.randint(10,29))
+
+    lines = ["SYNTHETIC STORE","{}/{}/{}".format(day,month,year),""]
+    lines += ["{}  {}.{}".format(i["name"].upper(),i["price_whole_part"],i["price_fractional_part"]) for i in items]
+    lines += ["","TOTAL  {}.{:02d}".format(total // 100,total % 100)]
+
+    label = {
+        "day":day,
+        "month":month,
+        "year":year,
+        "total_whole_part":str(total // 100),
+        "total_fractional_part":"{:02d}".format(total % 100),
+        "items":items
+    }
+    return lines,label
+
+def renderLines(lines,width):
+    """ draws the lines black on white, left aligned, with the font scaled to the width """
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    scale = width / 600
+    thickness = max(1,round(scale * 1.5))
+    (_,text_h),baseline = cv2.getTextSize("Ag",font,scale,thickness)
+    line_h = int((text_h + baseline) * 1.6)
+    margin = width // 12
+
+    img = np.full((2 * margin + line_h * len(lines),width),255,np.uint8)
+    for i,line in enumerate(lines):
+        cv2.putText(img,line,(margin,margin + line_h * i + text_h),font,scale,0,thickness,cv2.LINE_AA)
+    return img
+
+def distort(img,skew,noise,rng):
+    """ rotates the image by skew degrees (growing the canvas so nothing is cut off) and adds gaussian noise with noise standard deviation """
+    if skew != 0:
+        h,w = img.shape
+        m = cv2.getRotationMatrix2D((w / 2,h / 2),skew,1.0)
+        cos,sin = abs(m[0,0]),abs(m[0,1])
+        new_w,new_h = int(h * sin + w * cos),int(h * cos + w * sin)
+        m[0,2] += new_w / 2 - w / 2
+        m[1,2] += new_h / 2 - h / 2
+        img = cv2.warpAffine(img,m,(new_w,new_h),flags=cv2.INTER_LINEAR,borderValue=255)
+
+    if noise > 0:
+        noisy = np.random.default_rng(rng.getrandbits(32)).normal(0,noise,img.shape) + img
+        img = noisy.clip(0,255).astype(np.uint8)
+    return img
+
+def renderReceipt(seed=0,item_count=10,width=1200,skew=0.0,noise=0.0,background=None):
+    """ returns a grayscale image of a random receipt and its label in the JsonPrinter format, the same seed gives the same receipt.
+        skew is the rotation in degrees, noise the standard deviation of the gaussian noise added,
+        if background is given (an intensity) the receipt is placed on a canvas of that colour twice its size, like a photo of the receipt
+    """
+    rng = random.Random(seed)
+    lines,label = receiptContents(rng,item_count)
+    img = renderLines(lines,width)
+
+    if background is not None:
+        h,w = img.shape
+        canvas = np.full((h * 2,w * 2),background,np.uint8)
+        canvas[h // 2:h // 2 + h,w // 2:w // 2 + w] = img
+        img = canvas
+
+    return distort(img,skew,noise,rng),label
+
+if __name__ == "__main__":
+    out_dir = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    width = int(sys.argv[3]) if len(sys.argv) > 3 else 1200
+    item_count = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+    skew = float(sys.argv[5]) if len(sys.argv) > 5 else 2
+    noise = float(sys.argv[6]) if len(sys.argv) > 6 else 8
+
+    os.makedirs(os.path.join(out_dir,"images"),exist_ok=True)
+    os.makedirs(os.path.join(out_dir,"labels"),exist_ok=True)
+    for i in range(count):
+        # alternate the direction of the skew
+        img,label = renderReceipt(i,item_count,width,skew if i % 2 == 0 else -skew,noise)
+        cv2.imwrite(os.path.join(out_dir,"images","synthetic-{}.png".format(i)),img)
+        with open(os.path.join(out_dir,"labels","synthetic-{}.json".format(i)),"w") as f:
+            json.dump(label,f,indent=4)
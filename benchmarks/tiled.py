@@ -0,0 +1,67 @@
+""" runs the region of interest crop and the pixel-local pre-processors of the default pipeline (Denoiser and the morphology) 
+    on a tall synthetic receipt photographed on a dark background, on the whole image and tiled with a memory budget from a memory mapped input,
+    each in its own process to compare peak memory. Checks the outputs are identical
+
+    usage: python -m benchmarks.tiled [items (default 75)] [width (default 1200)] [budget MB (default 16)]
+"""
+from preprocessing.Processors import RoiCropper,Denoiser,Dilater,Eroder,MorphologyPipeline
+from pipeline.Pipelines import Pipeline,loadImage
+from benchmarks.synthetic import renderReceipt
+import numpy as np
+import cv2
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+def localPipeline(memory_budget):
+    return Pipeline([
+        RoiCropper(copy=memory_budget is None),
+        Denoiser(lo_intensity_thresh=140),
+        MorphologyPipeline([Dilater(2,(2,2)),Eroder(2,(2,2)),Dilater(2,(2,2))]),
+    ],None,memory_budget=memory_budget)
+
+def child(path,budget,out_path):
+    """ pre-processes the image and saves the output, prints the seconds taken and peak resident memory in MB """
+    pipeline = localPipeline(budget)
+    start = time.perf_counter()
+    img,_ = pipeline.preprocess(loadImage(path,mmap=budget is not None))
+    seconds = time.perf_counter() - start
+    np.save(out_path,img)
+    print(seconds,resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+if __name__ == "__main__":
+    # every step runs in its own process, the peak memory of a process carries over to the processes it starts
+    if sys.argv[1:2] == ["--render"]:
+        img,_ = renderReceipt(0,int(sys.argv[3]),int(sys.argv[4]),0,30,background=60)
+        cv2.imwrite(sys.argv[2],img)
+        print("image: {}x{} ({:.1f}MB)".format(img.shape[1],img.shape[0],img.nbytes / 1024 ** 2))
+        sys.exit(0)
+
+    if sys.argv[1:2] == ["--child"]:
+        path,budget,out_path = sys.argv[2],sys.argv[3],sys.argv[4]
+        child(path,int(budget) if budget != "none" else None,out_path)
+        sys.exit(0)
+
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 75
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1200
+    budget = int(float(sys.argv[3]) * 1024 ** 2) if len(sys.argv) > 3 else 16 * 1024 ** 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp,"receipt.pgm")
+        print(subprocess.run([sys.executable,"-m","benchmarks.tiled","--render",path,str(items),str(width)],capture_output=True,text=True,check=True).stdout.strip())
+
+        outputs = []
+        for name,b in [("whole image","none"),("tiled, {:.0f}MB budget".format(budget / 1024 ** 2),str(budget))]:
+            out_path = os.path.join(tmp,"out-{}.npy".format(b))
+            result = subprocess.run([sys.executable,"-m","benchmarks.tiled","--child",path,b,out_path],capture_output=True,text=True,check=True)
+            seconds,peak = [float(v) for v in result.stdout.split()]
+            print("{:<24} {:>7.2f}s, peak resident memory {:>7.1f}MB".format(name,seconds,peak))
+            outputs.append(np.load(out_path))
+
+        if not np.array_equal(outputs[0],outputs[1]):
+            print("outputs are DIFFERENT")
+            sys.exit(1)
+        print("outputs are identical")
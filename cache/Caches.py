@@ -0,0 +1,104 @@
+import os
+import hashlib
+import inspect
+import pickle
+import tempfile
+
+# bump whenever the output of any stage changes for the same settings, invalidating old entries
+CACHE_VERSION = "2"
+
+def constructorSettings(obj,exclude=()):
+    """ returns a sorted list of (name,value) of the constructor arguments of the object which hold plain values,
+        used to fingerprint stage settings, engines and other helper objects are skipped
+    """
+    plain = (int,float,str,bool,tuple,list,dict,type(None))
+    settings = []
+    for name in inspect.signature(type(obj).__init__).parameters:
+        if name == "self" or name in exclude or not hasattr(obj,name):
+            continue
+        value = getattr(obj,name)
+        if isinstance(value,plain):
+            settings.append((name,value))
+    return sorted(settings)
+
+class ResultCache():
+    """
+    On disk content addressed cache of pipeline stage outputs, each stage is stored separately under its own key,
+    least recently used entries are evicted once the total size goes over max_bytes.
+    Entries are pickled, only point this at a directory you trust.
+    """
+    def __init__(self,directory,max_bytes=1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory,exist_ok=True)
+        self.size = sum(os.path.getsize(p) for (p,_) in self.entries())
+
+    def key(self,*parts):
+        """ hashes the given parts (bytes, buffers or strings) into a single key """
+        h = hashlib.sha256(CACHE_VERSION.encode())
+        for p in parts:
+            if isinstance(p,str):
+                p = p.encode()
+            h.update(len(p).to_bytes(8,"little"))
+            h.update(p)
+        return h.hexdigest()
+
+    def path(self,stage,key):
+        return os.path.join(self.directory,stage,key[:2],key)
+
+    def entries(self):
+        """ yields (path,last use time) of every entry """
+        for root,_,files in os.walk(self.directory):
+            for f in files:
+                if f.startswith(".tmp"):
+                    continue
+                p = os.path.join(root,f)
+                try:
+                    yield p,os.path.getmtime(p)
+                except OSError:
+                    # evicted by another process
+                    continue
+
+    def get(self,stage,key):
+        """ returns the stored value or None if missing or unreadable """
+        p = self.path(stage,key)
+        try:
+            with open(p,"rb") as f:
+                value = pickle.load(f)
+            # modification time marks last use for LRU eviction
+            os.utime(p)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # corrupt or written by an incompatible version, treat as a miss
+            return None
+
+    def put(self,stage,key,value):
+        p = self.path(stage,key)
+        os.makedirs(os.path.dirname(p),exist_ok=True)
+
+        # write to a temporary file first so readers never see partial entries
+        fd,tmp = tempfile.mkstemp(dir=os.path.dirname(p),prefix=".tmp")
+        with os.fdopen(fd,"wb") as f:
+            pickle.dump(value,f,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp,p)
+
+        self.size += os.path.getsize(p)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """ removes least recently used entries until the cache is below 90% of its size limit """
+        entries = sorted(self.entries(),key=lambda e: e[1])
+        self.size = sum(os.path.getsize(p) for (p,_) in entries if os.path.exists(p))
+
+        for (p,_) in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                size = os.path.getsize(p)
+                os.remove(p)
+                self.size -= size
+            except OSError:
+                continue
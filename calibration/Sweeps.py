@@ -0,0 +1,189 @@
+from cache.Caches import constructorSettings
+from parsing.Parsers import TextParser
+from pipeline.Pipelines import Pipeline,loadImage
+from preprocessing.Processors import MorphologyPipeline
+from output.Printers import JsonPrinter
+from evaluation.Metrics import evaluateReceipt
+import itertools
+import json
+import multiprocessing
+import random
+import collections
+import time
+
+def gridConfigs(grid):
+    """ returns every combination of the values of the grid, a dictionary of parameter name to the list of values to try """
+    names = sorted(grid)
+    return [dict(zip(names,values)) for values in itertools.product(*[grid[n] for n in names])]
+
+def randomConfigs(space,samples,seed=0):
+    """ returns samples random configurations of the space, a dictionary of parameter name to either a list of values to pick from
+        or a {"min":..,"max":..} range (integers if both bounds are)
+    """
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(samples):
+        config = {}
+        for name in sorted(space):
+            values = space[name]
+            if isinstance(values,dict):
+                if isinstance(values["min"],int) and isinstance(values["max"],int):
+                    config[name] = rng.randint(values["min"],values["max"])
+                else:
+                    config[name] = rng.uniform(values["min"],values["max"])
+            else:
+                config[name] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+def rebuild(obj,overrides):
+    """ a new instance of the object's class constructed with the same (plain) settings apart from the overrides """
+    settings = dict(constructorSettings(obj))
+    settings.update(overrides)
+    return type(obj)(**settings)
+
+def applyConfig(pipeline,config):
+    """ returns a copy of the pipeline with the configuration applied, parameter names are ClassName.parameter
+        and apply to every stage of that class, e.g. {"Denoiser.lo_intensity_thresh": 150, "ReceiptParser.price_regex": "..."}.
+        The Dilater and Eroder stages within a MorphologyPipeline count as stages too, e.g. {"Dilater.iterations": 1}.
+        Raises ValueError if a parameter doesn't match any stage
+    """
+    overrides = collections.defaultdict(dict)
+    for name,value in config.items():
+        cls,param = name.split(".",1)
+        overrides[cls][param] = value
+
+    def apply(stage):
+        if type(stage).__name__ in overrides:
+            return rebuild(stage,overrides[type(stage).__name__])
+        return stage
+
+    stages = pipeline.pre_processors + [pipeline.parser]
+    inner = [o for s in stages if isinstance(s,MorphologyPipeline) for o in s.stages()]
+    unknown = set(overrides) - set(type(s).__name__ for s in stages + inner)
+    if len(unknown) > 0:
+        raise ValueError("no stage of the pipeline is a " + ", ".join(sorted(unknown)))
+
+    stages = [MorphologyPipeline([apply(o) for o in s.stages()]) if isinstance(s,MorphologyPipeline) and "MorphologyPipeline" not in overrides else apply(s) 
+        for s in stages]
+    return Pipeline(stages[:-1],stages[-1])
+
+class StageNode():
+    """ a pre-processor shared by every pipeline whose chain starts with the same stages up to and including it """
+    __slots__ = ("processor","children","leaves")
+
+    def __init__(self,processor=None):
+        self.processor = processor
+        self.children = {}
+        # indices of the pipelines whose pre-processing ends here
+        self.leaves = []
+
+class StageTree():
+    """
+    Memoized stages of a set of pipelines, pipelines whose pre-processors start with the same stages (with the same settings)
+    share the output of those stages, and pipelines whose parsers run the same OCR share the OCR text.
+    Running an image walks the tree depth first, so only the outputs along the current path are held in memory
+    """
+    def __init__(self,pipelines):
+        self.pipelines = pipelines
+        self.root = StageNode()
+        for i,pipeline in enumerate(pipelines):
+            node = self.root
+            for p in pipeline.pre_processors:
+                node = node.children.setdefault(p.fingerprint(),StageNode(p))
+            node.leaves.append(i)
+
+    def stageCount(self):
+        """ the number of pre-processing stages run per image, against sum(len(p.pre_processors)) without sharing """
+        count = 0
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            count += len(node.children)
+            stack.extend(node.children.values())
+        return count
+
+    def run(self,img):
+        """ returns the (receipt,seconds) of every pipeline for the image, seconds being the time the pipeline would have taken on its own """
+        results = [None] * len(self.pipelines)
+        self.visit(self.root,img,None,0.0,results)
+        return results
+
+    def visit(self,node,img,ocr_result,seconds,results):
+        texts = {}
+        for i in node.leaves:
+            parser = self.pipelines[i].parser
+            if isinstance(parser,TextParser):
+                key = parser.ocrFingerprint()
+                if key not in texts:
+                    start = time.perf_counter()
+                    texts[key] = (parser.extractText(img,ocr_result),time.perf_counter() - start)
+                text,ocr_seconds = texts[key]
+                start = time.perf_counter()
+                receipt = parser.parseText(text)
+                results[i] = (receipt,seconds + ocr_seconds + time.perf_counter() - start)
+            else:
+                start = time.perf_counter()
+                receipt = parser.parseReceipt(img,ocr_result)
+                results[i] = (receipt,seconds + time.perf_counter() - start)
+
+        for child in node.children.values():
+            start = time.perf_counter()
+            out = child.processor.process(img)
+            elapsed = time.perf_counter() - start
+            self.visit(child,out,child.processor.ocrResult() or ocr_result,seconds + elapsed,results)
+
+def initSweepWorker(pipeline_factory,options,configs):
+    """ builds the stage tree of the configurations once per worker process """
+    global sweep_tree
+    base = pipeline_factory(options)
+    sweep_tree = StageTree([applyConfig(base,c) for c in configs])
+
+def sweepImage(job):
+    """ runs every configuration on a single labelled image, never raises.
+        returns the image path, the error message or None on success and the list of (normalized error,seconds) per configuration
+    """
+    path,label_path,matching = job
+    try:
+        img = loadImage(path)
+        with open(label_path) as f:
+            label = json.load(f)
+
+        printer = JsonPrinter()
+        scores = []
+        for (receipt,seconds) in sweep_tree.run(img):
+            scores.append((evaluateReceipt(label,printer.toDict(receipt),matching)["normalized_total_error"],seconds))
+        return (path,None,scores)
+    except Exception as e:
+        return (path,type(e).__name__ + ": " + str(e),None)
+
+def runSweep(jobs,configs,pipeline_factory,options,workers=1):
+    """ evaluates the configurations on the (image path,label path,matching) jobs, spreading the images across a pool of workers.
+        yields the result of sweepImage for each job, in order
+    """
+    if workers == 1:
+        initSweepWorker(pipeline_factory,options,configs)
+        for job in jobs:
+            yield sweepImage(job)
+    else:
+        with multiprocessing.Pool(workers,initializer=initSweepWorker,initargs=(pipeline_factory,options,configs)) as pool:
+            yield from pool.imap(sweepImage,jobs)
+
+def rankConfigs(configs,scores):
+    """ given the list of (normalized error,seconds) per configuration of every image,
+        returns the configurations ranked by mean error (then mean seconds) as dictionaries with their rank, mean error and mean seconds
+    """
+    table = []
+    for i,config in enumerate(configs):
+        errors = [s[i][0] for s in scores]
+        seconds = [s[i][1] for s in scores]
+        table.append({
+            "config":config,
+            "mean_error":sum(errors) / len(errors) if len(errors) > 0 else None,
+            "mean_seconds":sum(seconds) / len(seconds) if len(seconds) > 0 else None
+        })
+
+    table.sort(key=lambda r: (r["mean_error"] is None,r["mean_error"] or 0,r["mean_seconds"] or 0))
+    for rank,row in enumerate(table):
+        row["rank"] = rank + 1
+    return table
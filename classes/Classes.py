@@ -1,7 +1,17 @@
+from decimal import Decimal
+
+def priceOf(whole,fractional):
+    """ the Decimal value of a price given as its whole and fractional parts (strings of digits), None if either is missing """
+    if whole in (None,"") or fractional in (None,""):
+        return None
+    return Decimal(str(whole) + "." + str(fractional))
+
 class Item():
     """
-    A receipt item
+    A receipt item, the price is kept as its whole and fractional parts as read from the receipt, with its value available as the price property
     """
+    __slots__ = ("name","price_whole_part","price_fractional_part")
+
     def __init__(self):
         self.name = None
         self.price_whole_part = None
@@ -10,10 +20,17 @@ class Item():
     def __repr__(self) -> str:
         return str(self.name) + ":" + str(self.price_whole_part) +"." + str(self.price_fractional_part)
 
+    @property
+    def price(self):
+        """ the price as a Decimal, None if not known """
+        return priceOf(self.price_whole_part,self.price_fractional_part)
+
 class Receipt():
     """
-    A receipt detailing a purchase of a list of items on a certain date
+    A receipt detailing a purchase of a list of items on a certain date, source identifies the input it was parsed from (if known)
     """
+    __slots__ = ("items","day","month","year","total_whole_part","total_fractional_part","source")
+
     def __init__(self):
         self.items = []
         self.day = None
@@ -22,3 +39,72 @@ class Receipt():
 
         self.total_whole_part = None
         self.total_fractional_part = None
+        self.source = None
+
+    @property
+    def total(self):
+        """ the total as a Decimal, None if not known """
+        return priceOf(self.total_whole_part,self.total_fractional_part)
+
+class OcrResult():
+    """
+    The layout found by an OCR pass, holds the tesseract data table (levels, boxes, confidences and words) 
+    so that stages after the one which performed OCR can reuse it instead of running OCR again
+    """
+    def __init__(self,data):
+        """ data is a dictionary of equal length columns as returned by pytesseract.image_to_data with Output.DICT """
+        self.data = data
+
+    @staticmethod
+    def fromTsv(tsv):
+        """ builds the result from tesseract's tsv output, with or without the header row """
+        columns = ["level","page_num","block_num","par_num","line_num","word_num","left","top","width","height","conf","text"]
+        data = {c:[] for c in columns}
+
+        for row in tsv.splitlines():
+            fields = row.split("\t")
+            if len(fields) < len(columns) - 1 or fields[0] == "level":
+                continue
+
+            for c,v in zip(columns[:-2],fields):
+                data[c].append(int(v))
+            data["conf"].append(float(fields[10]))
+            data["text"].append(fields[11] if len(fields) > 11 else "")
+
+        return OcrResult(data)
+
+    def words(self):
+        """ returns list of (text,(x,y,w,h),confidence) tuples for each recognized word in reading order """
+        d = self.data
+        return [(d['text'][i],(d['left'][i],d['top'][i],d['width'][i],d['height'][i]),float(d['conf'][i]))
+            for i in range(len(d['level'])) if d['level'][i] == 5 and str(d['text'][i]).strip() != ""]
+
+    def lines(self):
+        """ returns the text of each line of words in reading order """
+        d = self.data
+        lines = []
+        current_key = None
+        for i in range(len(d['level'])):
+            text = str(d['text'][i]).strip()
+            if d['level'][i] != 5 or text == "":
+                continue
+
+            key = (d['block_num'][i],d['par_num'][i],d['line_num'][i])
+            if key != current_key:
+                lines.append([])
+                current_key = key
+            lines[-1].append(text)
+
+        return [" ".join(l) for l in lines]
+
+    @property
+    def text(self):
+        """ the recognized text with one line per OCR line """
+        return "\n".join(self.lines())
+
+    def meanConfidence(self):
+        """ mean confidence (0-100) of the recognized words, None if no words were found """
+        confidences = [c for (_,_,c) in self.words()]
+        if len(confidences) == 0:
+            return None
+        return sum(confidences) / len(confidences)
@@ -0,0 +1,22 @@
+import importlib
+
+class LazyModule():
+    """
+    Stands in for a module which is only imported the first time one of its attributes is used, 
+    so heavy dependencies (numpy, OpenCV, pytesseract..) aren't loaded by code paths which never need them.
+    Attributes are copied onto the stand-in as they are used, so later lookups cost the same as on the module
+    """
+    def __init__(self,name):
+        self.__dict__["_lazy_name"] = name
+
+    def __getattr__(self,attr):
+        value = getattr(importlib.import_module(self.__dict__["_lazy_name"]),attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return "<lazy module '{}'>".format(self.__dict__["_lazy_name"])
+
+def lazyImport(name):
+    """ returns a stand-in for the module which imports it at first use, e.g. np = lazyImport("numpy") """
+    return LazyModule(name)
@@ -0,0 +1,247 @@
+""" error metrics used in analytics mode to compare parsed receipts against labelled ones """
+from common.Lazy import lazyImport
+
+np = lazyImport("numpy")
+
+def wordDistance(seq1,seq2):
+    """ levenshtein distance between the two strings, computed with the bit-parallel algorithm of Myers/Hyyrö
+        which processes a whole column of the edit distance matrix per character using python's unbounded ints
+    """
+    # the shorter string forms the bit vectors
+    if len(seq1) < len(seq2):
+        seq1,seq2 = seq2,seq1
+    m = len(seq2)
+    if m == 0:
+        return len(seq1)
+
+    peq = {}
+    for i,c in enumerate(seq2):
+        peq[c] = peq.get(c,0) | (1 << i)
+
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv = mask
+    mv = 0
+    score = m
+    for c in seq1:
+        eq = peq.get(c,0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+
+    return score
+
+def wordDistances(pairs):
+    """ levenshtein distances of a batch of string pairs, pairs whose shorter string fits in 64 characters 
+        are computed together with the same bit-parallel algorithm over lanes of a uint64 numpy array 
+    """
+    distances = np.zeros(len(pairs),np.int64)
+
+    lanes = []
+    for i,(a,b) in enumerate(pairs):
+        if len(a) < len(b):
+            a,b = b,a
+        if len(b) == 0:
+            distances[i] = len(a)
+        elif len(b) <= 64:
+            lanes.append((i,a,b))
+        else:
+            distances[i] = wordDistance(a,b)
+
+    if len(lanes) == 0:
+        return distances
+
+    n = len(lanes)
+    text_len = np.array([len(a) for (_,a,_) in lanes],np.int64)
+    pattern_len = np.array([len(b) for (_,_,b) in lanes],np.uint64)
+
+    # match vectors of each lane's pattern for each character of its text
+    eq = np.zeros((int(text_len.max()),n),np.uint64)
+    for lane,(_,a,b) in enumerate(lanes):
+        peq = {}
+        for i,c in enumerate(b):
+            peq[c] = peq.get(c,0) | (1 << i)
+        eq[:len(a),lane] = [peq.get(c,0) for c in a]
+
+    one = np.uint64(1)
+    mask = np.where(pattern_len == 64,np.uint64(0xFFFFFFFFFFFFFFFF),(one << pattern_len) - one)
+    high = one << (pattern_len - one)
+    pv = mask.copy()
+    mv = np.zeros(n,np.uint64)
+    score = pattern_len.astype(np.int64)
+
+    for j in range(eq.shape[0]):
+        e = eq[j]
+        active = j < text_len
+        xv = e | mv
+        xh = (((e & pv) + pv) ^ pv) | e
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        score += active & ((ph & high) != 0)
+        score -= active & ((ph & high) == 0) & ((mh & high) != 0)
+        ph = (ph << one) | one
+        mh = mh << one
+        # lanes past the end of their text keep their state
+        pv = np.where(active,(mh | ~(xv | ph)) & mask,pv)
+        mv = np.where(active,ph & xv & mask,mv)
+
+    distances[[i for (i,_,_) in lanes]] = score
+    return distances
+
+def normalizedError(total_distance,total_label_characters):
+    return total_distance / (total_label_characters + 1)
+
+def jsonLeafStrings(json,leafs):
+    """ utility for nested dictionary val extraction """
+    for v in json.values():
+        if isinstance(v,dict):
+            jsonLeafStrings(v,leafs)
+        elif isinstance(v,list):
+            for i in v:
+                jsonLeafStrings(i,leafs)
+        else:
+            leafs.append(v)
+                
+    return leafs
+
+def hungarian(cost):
+    """ minimum cost assignment of rows to columns of the cost matrix with no more rows than columns,
+        returns the assigned column of each row
+    """
+    n,m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1,np.int64)
+    way = np.zeros(m + 1,np.int64)
+
+    for i in range(1,n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1,np.inf)
+        used = np.zeros(m + 1,bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            free = ~used[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            candidates = np.where(free,minv[1:],np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0 != 0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    assignment = np.zeros(n,np.int64)
+    for j in range(1,m + 1):
+        if p[j] != 0:
+            assignment[p[j] - 1] = j - 1
+    return assignment
+
+def linearSumAssignment(cost):
+    """ returns (rows,cols) of the minimum cost matching, uses scipy when installed """
+    try:
+        from scipy.optimize import linear_sum_assignment
+        return linear_sum_assignment(cost)
+    except ImportError:
+        pass
+
+    if cost.shape[0] <= cost.shape[1]:
+        return np.arange(cost.shape[0]),hungarian(cost)
+
+    cols = hungarian(cost.T)
+    order = np.argsort(cols)
+    return cols[order],np.arange(cost.shape[1])[order]
+
+def matchItems(label_items,output_items,name_distances,matching="greedy"):
+    """ matches label items to output items using the (labels x outputs) matrix of name distances,
+        returns the list of (label index, output index or None) and the set of matched output indices.
+
+        "greedy" matches each label in turn to the closest output whose name wasn't matched yet, as analytics mode always has,
+        "optimal" finds the matching with the smallest total name distance
+    """
+    if matching == "optimal":
+        rows,cols = linearSumAssignment(name_distances) if name_distances.size > 0 else ([],[])
+        matched = dict(zip([int(r) for r in rows],[int(c) for c in cols]))
+        assignment = [(i,matched.get(i)) for i in range(len(label_items))]
+        return assignment,set(matched.values())
+
+    # outputs sharing a name with an assigned one count as assigned
+    names = [o["name"] for o in output_items]
+    available = np.ones(len(output_items),bool)
+    assignment = []
+    for i in range(len(label_items)):
+        if not available.any():
+            assignment.append((i,None))
+            continue
+
+        # argmin picks the first of equally close outputs
+        j = int(np.argmin(np.where(available,name_distances[i],np.inf)))
+        assignment.append((i,j))
+        available &= [n != names[j] for n in names]
+
+    return assignment,set(np.flatnonzero(~available).tolist())
+
+def evaluateReceipt(label_data,output_data,matching="greedy"):
+    """ compares the output json data against the label data, both in the JsonPrinter format, and returns the analytics result dictionary """
+    label_items = label_data["items"]
+    output_items = output_data["items"]
+    fields = ["day","month","year","total_whole_part","total_fractional_part"]
+
+    # all name pairs are needed for the matching, compute them in one batch with the fields
+    pairs = [(label_data[f],output_data[f]) for f in fields]
+    pairs += [(l["name"],o["name"]) for l in label_items for o in output_items]
+    distances = wordDistances(pairs)
+    day_dist,month_dist,year_dist,total_w_dist,total_f_dist = [float(d) for d in distances[:len(fields)]]
+    name_distances = distances[len(fields):].reshape(len(label_items),len(output_items))
+
+    assignment,matched_outputs = matchItems(label_items,output_items,name_distances,matching)
+
+    # compare based on this matching, reusing the name distances
+    items_distance = 0
+    price_pairs = []
+    for (i,j) in assignment:
+        label = label_items[i]
+        if j is not None:
+            items_distance += name_distances[i,j]
+            price_pairs.append((label["price_whole_part"],output_items[j]["price_whole_part"]))
+            price_pairs.append((label["price_fractional_part"],output_items[j]["price_fractional_part"]))
+        else:
+            # add length of missed item and its fields to item distance
+            items_distance += len(label["name"]) + len(label["price_whole_part"]) + len(label["price_fractional_part"])
+    items_distance += wordDistances(price_pairs).sum()
+
+    # now penalize additional found items, by adding their lengths to items distance
+    for j,item in enumerate(output_items):
+        if j not in matched_outputs:
+            items_distance += len(item["name"] or "") + len(item["price_whole_part"] or "") + len(item["price_fractional_part"] or "")
+    items_distance = float(items_distance)
+
+    chars_in_output = sum([len(x) for x in jsonLeafStrings(label_data,[])])
+    total_error = day_dist + month_dist + year_dist + total_w_dist + total_f_dist + items_distance
+    return {
+        "date_dist":day_dist + month_dist + year_dist,
+        "total_dist": total_w_dist + total_f_dist,
+        "item_dist": items_distance,
+        "total_word_distance": total_error,
+        "total_characters_label": chars_in_output,
+        "normalized_total_error": normalizedError(total_error,chars_in_output)
+    }
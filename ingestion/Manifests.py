@@ -0,0 +1,75 @@
+import os
+import json
+
+IMAGE_EXTENSIONS = (".png",".jpg",".jpeg",".tif",".tiff",".bmp",".pgm",".npy")
+
+def iterInputs(directory,extensions=IMAGE_EXTENSIONS):
+    """ lazily walks the directory tree yielding the paths of the images in it relative to the directory, 
+        entries of each directory are visited in sorted order so runs are deterministic
+    """
+    stack = [""]
+    while len(stack) > 0:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(directory,rel_dir)) as it:
+            entries = sorted(it,key=lambda e: e.name)
+
+        subdirs = []
+        for e in entries:
+            rel = os.path.join(rel_dir,e.name)
+            if e.is_dir():
+                subdirs.append(rel)
+            elif e.is_file() and os.path.splitext(e.name)[1].lower() in extensions:
+                yield rel
+
+        # visit subdirectories after the files, in sorted order
+        stack.extend(reversed(subdirs))
+
+class Manifest():
+    """
+    Append only checkpoint of a bulk run, one json record per finished input holding the input's modification time, 
+    the fingerprint of the pipeline which processed it and its analytics error (if any).
+    Lets a killed or repeated run skip inputs which are already up to date.
+    """
+    def __init__(self,path):
+        self.path = path
+        self.records = {}
+
+        if os.path.exists(path):
+            with open(path,"r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # partially written last line of a killed run
+                        continue
+                    self.records[record["input"]] = record
+
+        os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+        self.file = open(path,"a")
+
+    def upToDate(self,rel,input_path,output_path,fingerprint,needs_error=False):
+        """ returns the record of the input if its output is newer than it and was produced with the same pipeline fingerprint, None otherwise """
+        record = self.records.get(rel)
+        if record is None or record["fingerprint"] != fingerprint:
+            return None
+        if needs_error and record.get("error") is None:
+            return None
+
+        try:
+            input_mtime = os.path.getmtime(input_path)
+            if record["mtime"] != input_mtime or os.path.getmtime(output_path) < input_mtime:
+                return None
+        except OSError:
+            return None
+
+        return record
+
+    def record(self,rel,input_path,fingerprint,error=None):
+        """ checkpoints a finished input, error is its normalized analytics error """
+        record = {"input":rel,"mtime":os.path.getmtime(input_path),"fingerprint":fingerprint,"error":error}
+        self.records[rel] = record
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,200 @@
+from abc import ABC, abstractmethod
+import threading
+import queue
+import subprocess
+import sys
+from common.Lazy import lazyImport
+from classes.Classes import OcrResult
+from profiling.Profilers import stage
+
+np = lazyImport("numpy")
+pytesseract = lazyImport("pytesseract")
+
+class OcrEngine(ABC):
+    """ performs OCR on grayscale (or BGR) images, implementations must be safe to call from multiple threads """
+
+    @abstractmethod
+    def imageToString(self,img,lang="eng",config=""):
+        """ returns the text found in the image """
+        pass
+
+    @abstractmethod
+    def imageToData(self,img,lang="eng",config=""):
+        """ returns an OcrResult with the boxes, confidences and words found in the image """
+        pass
+
+class PytesseractEngine(OcrEngine):
+    """ runs a new tesseract process for each call, the image is written to a temporary file by pytesseract """
+
+    def imageToString(self,img,lang="eng",config=""):
+        with stage("ocr.image_to_string"):
+            return pytesseract.image_to_string(img,lang=lang,config=config)
+
+    def imageToData(self,img,lang="eng",config=""):
+        with stage("ocr.image_to_data"):
+            return OcrResult(pytesseract.image_to_data(img,lang=lang,config=config,output_type=pytesseract.Output.DICT))
+
+class PipedTesseractEngine(OcrEngine):
+    """ runs a new tesseract process for each call like pytesseract, but pipes the image in as an uncompressed PNM 
+        through stdin and reads the results from stdout, so nothing touches the disk
+    """
+
+    def __init__(self,cmd="tesseract"):
+        self.cmd = cmd
+
+    def command(self,lang,config,output=None):
+        """ the tesseract command line reading from stdin and writing to stdout, output is the output format, e.g. tsv """
+        return [self.cmd,"stdin","stdout","-l",lang] + config.split() + ([output] if output else [])
+
+    def encode(self,img):
+        """ encodes the image as a binary PGM/PPM, which costs little more than a copy """
+        img = np.ascontiguousarray(img,dtype=np.uint8)
+        (h,w) = img.shape[:2]
+        if img.ndim == 2:
+            return "P5\n{} {}\n255\n".format(w,h).encode() + img.tobytes()
+        # tesseract expects RGB
+        return "P6\n{} {}\n255\n".format(w,h).encode() + np.ascontiguousarray(img[:,:,2::-1]).tobytes()
+
+    def run(self,img,lang,config,output=None):
+        result = subprocess.run(self.command(lang,config,output),input=self.encode(img),stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError("tesseract failed: " + result.stderr.decode(errors="replace").strip())
+        return result.stdout.decode("utf-8")
+
+    def imageToString(self,img,lang="eng",config=""):
+        with stage("ocr.image_to_string"):
+            return self.run(img,lang,config)
+
+    def imageToData(self,img,lang="eng",config=""):
+        with stage("ocr.image_to_data"):
+            return OcrResult.fromTsv(self.run(img,lang,config,"tsv"))
+
+class TesserocrEngine(OcrEngine):
+    """ keeps a pool of long lived tesseract instances (via the tesserocr C-API bindings) per language so the models are loaded only once,
+        images are handed over in memory
+    """
+
+    def __init__(self,pool_size=4,path=None):
+        """ pool_size is the maximum number of tesseract instances per language, callers block when all of them are busy. 
+            path is the tessdata directory, None uses tesseract's default
+        """
+        import tesserocr
+        self.tesserocr = tesserocr
+        self.pool_size = pool_size
+        self.path = path
+        self.pools = {}
+        self.created = {}
+        self.lock = threading.Lock()
+
+    def acquire(self,lang):
+        """ takes an idle instance for the language out of the pool, creating one if the pool isn't full yet """
+        while True:
+            with self.lock:
+                pool = self.pools.setdefault(lang,queue.Queue())
+                # None is put in the pool when a slot is given up (see release), it is skipped so the slot is filled below
+                api = None
+                while api is None and not pool.empty():
+                    api = pool.get_nowait()
+                if api is not None:
+                    return api
+                if self.created.get(lang,0) < self.pool_size:
+                    # the slot is only taken once the instance exists, a failed init leaves it for the next caller
+                    api = self.newInstance(lang)
+                    self.created[lang] = self.created.get(lang,0) + 1
+                    return api
+
+            api = pool.get()
+            if api is not None:
+                return api
+
+    def newInstance(self,lang):
+        kwargs = {"lang":lang} if self.path is None else {"lang":lang,"path":self.path}
+        return self.tesserocr.PyTessBaseAPI(**kwargs)
+
+    def release(self,lang,api,reusable=True):
+        """ returns the instance to the pool, instances which had variables changed are discarded so they don't affect later calls.
+            If a replacement can't be created its slot is given up, waking a waiting caller to try creating one itself
+        """
+        if not reusable:
+            api.End()
+            try:
+                api = self.newInstance(lang)
+            except Exception:
+                with self.lock:
+                    self.created[lang] -= 1
+                # the error surfaces on the next attempt to create an instance, rather than replacing the result of this call
+                self.pools[lang].put(None)
+                return
+        self.pools[lang].put(api)
+
+    def recognize(self,api,img,config):
+        """ configures the instance as the tesseract command line would with the given config and sets the image,
+            returns False if variables were changed and the instance shouldn't be reused 
+        """
+        args = config.split()
+        psm = self.tesserocr.PSM.AUTO
+        reusable = True
+        for i,a in enumerate(args):
+            if a == "--psm" and i + 1 < len(args):
+                psm = int(args[i + 1])
+            elif a == "-c" and i + 1 < len(args):
+                name,value = args[i + 1].split("=",1)
+                api.SetVariable(name,value)
+                reusable = False
+
+        api.SetPageSegMode(psm)
+
+        img = np.ascontiguousarray(img)
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        if channels == 3:
+            # tesseract expects RGB
+            img = np.ascontiguousarray(img[:,:,::-1])
+        (h,w) = img.shape[:2]
+        api.SetImageBytes(img.tobytes(),w,h,channels,w * channels)
+        return reusable
+
+    def imageToString(self,img,lang="eng",config=""):
+        with stage("ocr.image_to_string"):
+            api = self.acquire(lang)
+            reusable = True
+            try:
+                reusable = self.recognize(api,img,config)
+                return api.GetUTF8Text()
+            finally:
+                api.Clear()
+                self.release(lang,api,reusable)
+
+    def imageToData(self,img,lang="eng",config=""):
+        with stage("ocr.image_to_data"):
+            api = self.acquire(lang)
+            reusable = True
+            try:
+                reusable = self.recognize(api,img,config)
+                api.Recognize()
+                return OcrResult.fromTsv(api.GetTSVText(0))
+            finally:
+                api.Clear()
+                self.release(lang,api,reusable)
+
+default_engine = None
+default_engine_lock = threading.Lock()
+
+def tesseractCommand():
+    """ the tesseract binary, as configured via pytesseract.pytesseract.tesseract_cmd if pytesseract was imported (which configuring it requires), pytesseract isn't imported otherwise """
+    if "pytesseract" in sys.modules:
+        return sys.modules["pytesseract"].pytesseract.tesseract_cmd
+    return "tesseract"
+
+def getDefaultEngine():
+    """ returns the engine shared by all stages in this process, the tesserocr pool when tesserocr is installed and 
+        otherwise a tesseract process per call with the image piped in memory
+    """
+    global default_engine
+    with default_engine_lock:
+        if default_engine is None:
+            try:
+                default_engine = TesserocrEngine()
+            except ImportError:
+                default_engine = PipedTesseractEngine(tesseractCommand())
+
+    return default_engine
@@ -2,6 +2,12 @@ from classes.Classes import Item,Receipt
 import json 
 from abc import ABC, abstractmethod
 
+# optional faster json encoder for the streaming printers
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class Printer(ABC):
     @abstractmethod
@@ -12,14 +18,17 @@ class Printer(ABC):
 class JsonPrinter(Printer):
 
     def printOutput(self,receipt,file):
+        json.dump(self.toDict(receipt), file,indent=4)
 
+    def toDict(self,receipt):
+        """ the json serializable dictionary printed for the receipt """
         items = [{
             "name": str(x.name),
             "price_whole_part": str(x.price_whole_part),
             "price_fractional_part": str(x.price_fractional_part)
         } for x in receipt.items]
 
-        r = {
+        return {
             "day":str(receipt.day),
             "month":str(receipt.month),
             "year":str(receipt.year),
@@ -28,5 +37,69 @@ class JsonPrinter(Printer):
             "items": items
         }
 
-        json.dump(r, file,indent=4)
 
+def dumpsCompact(data):
+    """ the data as single line json, encoded with orjson when it is installed """
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data,separators=(",",":"),ensure_ascii=False)
+
+class JsonlPrinter(JsonPrinter):
+    """ 
+    Streams receipts as json lines, one compact line per receipt holding its source and the same fields as JsonPrinter,
+    so a whole batch ends up in a single file instead of a file per receipt
+    """
+    def __init__(self,output=None):
+        """ output is the path of the file to append to or an open file, None to only print to the files given to printOutput """
+        self.owns_file = isinstance(output,str)
+        self.file = open(output,"a",encoding="utf-8") if self.owns_file else output
+
+    def printOutput(self,receipt,file=None):
+        data = {"source":receipt.source}
+        data.update(self.toDict(receipt))
+        (file or self.file).write(dumpsCompact(data) + "\n")
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+
+class ParquetPrinter(JsonPrinter):
+    """
+    Streams receipts into a single Parquet table with the source and JsonPrinter fields as columns (items being a list of structs),
+    rows are buffered and written batch_size at a time. Needs the optional pyarrow package
+    """
+    def __init__(self,path,batch_size=1024):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.batch_size = batch_size
+
+        item = pyarrow.struct([(f,pyarrow.string()) for f in ["name","price_whole_part","price_fractional_part"]])
+        fields = ["source","day","month","year","total_whole_part","total_fractional_part"]
+        self.schema = pyarrow.schema([(f,pyarrow.string()) for f in fields] + [("items",pyarrow.list_(item))])
+        self.columns = {name:[] for name in self.schema.names}
+        self.writer = None
+
+    def printOutput(self,receipt,file=None):
+        """ buffers the receipt, the table is written to the path given on construction (file is ignored) """
+        data = self.toDict(receipt)
+        data["source"] = receipt.source
+        for name,column in self.columns.items():
+            column.append(data[name])
+
+        if len(self.columns["source"]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ writes the buffered receipts as a row group """
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path,self.schema)
+        if len(self.columns["source"]) > 0:
+            self.writer.write_table(self.pa.Table.from_pydict(self.columns,schema=self.schema))
+            self.columns = {name:[] for name in self.schema.names}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
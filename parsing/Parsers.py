@@ -1,43 +1,235 @@
-from datetime import date
-import cv2
-import numpy as np
-import sys
-from matplotlib import pyplot as plt
-import pytesseract
-from pytesseract import Output
+from ocr.Engines import getDefaultEngine
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import re 
+import threading
 from classes.Classes import Item,Receipt
+from cache.Caches import constructorSettings
+from profiling.Profilers import stage
+from common.Lazy import lazyImport
+
+np = lazyImport("numpy")
+cv2 = lazyImport("cv2")
+
+class PriceMatch():
+    """ a price found on a line of text, start and end are positions within the line """
+    __slots__ = ("start","end","whole","fractional")
+
+    def __init__(self,start,end,whole,fractional):
+        self.start = start
+        self.end = end
+        self.whole = whole
+        self.fractional = fractional
+
+    @property
+    def value(self):
+        return float(self.whole + "." + self.fractional)
+
+class DateMatch():
+    """ a date found on a line of text """
+    __slots__ = ("start","end","day","month","year")
+
+    def __init__(self,start,end,day,month,year):
+        self.start = start
+        self.end = end
+        self.day = day
+        self.month = month
+        self.year = year
+
+class TextIndex():
+    """ the lines of a text along with the price and date matches found on each, built in a single pass over the text """
+    __slots__ = ("lines","prices","dates")
+
+    def __init__(self,lines,prices,dates):
+        self.lines = lines
+        self.prices = prices
+        self.dates = dates
 
 class Parser(ABC):
     
     @abstractmethod
-    def parseReceipt(self,img):
+    def parseReceipt(self,img,ocr_result=None):
+        """ parses the pre-processed image, ocr_result is the OCR output of an earlier stage (if any) which the parser may use instead of running OCR itself """
         pass
 
-class ReceiptParser(Parser):
+    def fingerprint(self):
+        """ a string identifying the parser and its settings, used in cache keys """
+        return type(self).__name__ + repr(constructorSettings(self))
+
+class TextParser(Parser):
+    """ a parser working in two steps, OCR of the image followed by parsing of the text, which lets the steps be cached separately """
+
+    @abstractmethod
+    def extractText(self,img,ocr_result=None):
+        """ returns the normalized text found in the image """
+        pass
+
+    @abstractmethod
+    def parseText(self,text):
+        """ returns the receipt parsed out of the normalized text """
+        pass
+
+    def ocrFingerprint(self):
+        """ a string identifying the settings which affect extractText, used in cache keys """
+        return self.fingerprint()
+
+    def parseReceipt(self,img,ocr_result=None):
+        return self.parseText(self.extractText(img,ocr_result))
+
+class ReceiptParser(TextParser):
     def __init__(self,
         lang="eng",
         price_regex= r".(?P<w>\b\d+)\.(?P<f>\d+)\b",
-        date_regex=r"(?P<d>\d+)/(?P<m>\d+)/(?P<y>\d+)"):
+        date_regex=r"(?P<d>\d+)/(?P<m>\d+)/(?P<y>\d+)",
+        reuse_ocr=False,
+        engine=None,
+        line_bands=False,
+        band_workers=4,
+        band_config="--psm 7",
+        band_gap=3,
+        block_config="--psm 6"):
 
         """ lang is the tesseract language code to use in OCR, price regex is a regex which matches any prices in the receipt and captures w,f as the whole and fractional parts respectively.
             Similarly the date regex catches the d,m,y for day month and years respectively.
+            If reuse_ocr is set, the text found by an earlier OCR stage is parsed when available instead of running OCR on the pre-processed image again,
+            this halves the OCR work but the text comes from the image as it was at that stage (i.e. before deskewing)
+            engine is the OcrEngine used, None uses the default engine of the process
+            If line_bands is set the image is split into lines of text (see lineBands, runs of text rows closer than band_gap rows are joined before splitting) 
+            which are recognized concurrently on band_workers threads with the band_config tesseract settings (a single line by default),
+            bands which couldn't be split into single lines are recognized with the block_config settings instead. This spreads a long receipt over several cores instead of one
         """
         self.lang = lang 
         self.price_regex = price_regex
         self.date_regex = date_regex
+        self.price_pattern = re.compile(price_regex)
+        self.date_pattern = re.compile(date_regex)
+        self.reuse_ocr = reuse_ocr
+        self.engine = engine or getDefaultEngine()
+        self.line_bands = line_bands
+        self.band_workers = band_workers
+        self.band_config = band_config
+        self.band_gap = band_gap
+        self.block_config = block_config
+        self.band_executor = None
+        self.band_lock = threading.Lock()
 
-    def parseReceipt(self,img):
-        
-        # perform OCR 
-        extracted_text = self.normalize_text(
-            pytesseract.image_to_string(img,lang=self.lang))
+    def fingerprint(self):
+        # the number of threads doesn't change the output
+        return type(self).__name__ + repr(constructorSettings(self,exclude=("band_workers",)))
+
+    def ocrFingerprint(self):
+        return type(self).__name__ + repr(constructorSettings(self,exclude=("price_regex","date_regex","band_workers")))
+
+    def extractText(self,img,ocr_result=None):
+
+        # perform OCR, unless we can reuse an earlier pass
+        if self.reuse_ocr and ocr_result is not None:
+            text = ocr_result.text
+        elif self.line_bands:
+            text = self.recognizeBands(img)
+        else:
+            text = self.engine.imageToString(img,lang=self.lang)
+        return self.normalize_text(text)
+
+    def lineBands(self,img):
+        """ returns the (y0,y1) row ranges (exclusive) of the lines of text in the pre-processed image, top to bottom.
+            Rows with a few dark pixels (specks) and long vertical strokes (borders, edge shadows) don't count as text,
+            runs of text rows taller than a line are then split at the minima of the number of dark pixels per row, where lines touch through descenders or noise
+        """
+        ink = (img < 128).view(np.uint8)
+        # vertical strokes much longer than a line of text are borders rather than text
+        stroke = max(32,img.shape[1] // 16)
+        if img.shape[0] > stroke:
+            ink = ink & (cv2.morphologyEx(ink,cv2.MORPH_OPEN,np.ones((stroke,1),np.uint8)) == 0)
+        profile = ink.sum(axis=1,dtype=np.int32)
+        if not profile.any():
+            return []
+        text = profile >= max(3,0.1 * np.median(profile[profile > 0]))
+
+        if self.band_gap > 1:
+            # a row counts as text if there is text within band_gap rows of it, joining runs split by gaps narrower than that
+            text = np.convolve(text,np.ones(self.band_gap,np.uint8),mode="same") > 0
+
+        # starts and ends of runs of text rows, runs a couple of rows high are specks rather than text
+        edges = np.flatnonzero(np.diff(np.concatenate(([0],text.view(np.int8),[0]))))
+        runs = [(y0,y1) for (y0,y1) in zip(edges[::2].tolist(),edges[1::2].tolist()) if y1 - y0 >= 4]
+
+        char_height = self.charHeight(ink)
+        smooth = np.convolve(profile,np.ones(3),mode="same")
+        bands = []
+        for (y0,y1) in runs:
+            if y1 - y0 > 1.5 * char_height:
+                cuts = self.splitRun(smooth,y0,y1,0.7 * char_height)
+                bands += list(zip(cuts,cuts[1:]))
+            else:
+                bands.append((y0,y1))
+        return bands
+
+    def charHeight(self,ink):
+        """ the typical height of a character, the median height of the blobs of ink (bar specks) """
+        _,_,stats,_ = cv2.connectedComponentsWithStats(ink,connectivity=8)
+        heights = stats[1:,cv2.CC_STAT_HEIGHT]
+        heights = heights[heights >= 4]
+        return float(np.median(heights)) if len(heights) > 0 else float(ink.shape[0])
+
+    def splitRun(self,smooth,y0,y1,min_height,depth=0.75):
+        """ returns the rows [y0,cut..,y1] splitting the run of text rows into lines, cutting at the local minima of the smoothed profile 
+            which are below depth times the peaks on either side of them and leave at least min_height rows on either side
+        """
+        minima = [y for y in range(y0 + 1,y1 - 1) if smooth[y] <= smooth[y - 1] and smooth[y] < smooth[y + 1]]
+        bounds = [y0] + minima + [y1]
+        cuts = [y0]
+        for i in range(1,len(bounds) - 1):
+            y = bounds[i]
+            if y - cuts[-1] < min_height or y1 - y < min_height:
+                continue
+            if smooth[y] < depth * min(smooth[cuts[-1]:y].max(),smooth[y:bounds[i + 1]].max()):
+                cuts.append(y)
+        cuts.append(y1)
+        return cuts
+
+    def bandImages(self,img,padding=4):
+        """ returns the (image,tesseract config) of each line of text of the image (see lineBands) in order, 
+            with padding rows of background above and below. Bands much taller than the typical line are recognized as blocks of text
+        """
+        bands = self.lineBands(img)
+        if len(bands) == 0:
+            return []
+        line_height = np.median([y1 - y0 for (y0,y1) in bands])
+        return [(cv2.copyMakeBorder(img[y0:y1],padding,padding,0,0,cv2.BORDER_CONSTANT,value=255),
+            self.block_config if y1 - y0 > 1.6 * line_height else self.band_config) for (y0,y1) in bands]
+
+    def joinBands(self,texts):
+        """ the text of the whole image given the text of each band in order """
+        return "\n".join(t.strip() for t in texts if t.strip() != "")
+
+    def recognizeBands(self,img):
+        """ recognizes each text band of the image concurrently and returns the text of the whole image """
+        bands = self.bandImages(img)
+        if len(bands) <= 1 or self.band_workers <= 1:
+            return self.joinBands([self.engine.imageToString(band,lang=self.lang,config=config) for (band,config) in bands])
+
+        # the pool is only started the first time it's needed
+        with self.band_lock:
+            if self.band_executor is None:
+                self.band_executor = ThreadPoolExecutor(self.band_workers,thread_name_prefix="ocr-band")
+
+        with stage("ocr.bands"):
+            texts = self.band_executor.map(lambda b: self.engine.imageToString(b[0],lang=self.lang,config=b[1]),bands)
+            return self.joinBands(list(texts))
+
+    def parseText(self,extracted_text):
             
+        # index the prices and dates on every line once, all the rules work off the index
+        index = self.scanText(extracted_text)
+
         # extract data according to custom rules
-        (total_w,total_f) = self.parseTotal(extracted_text) or ("","")
-        d,m,y = self.parseDate(extracted_text) or ("","","")
-        items = self.parseItems(extracted_text) or []
+        with stage("parser.parseTotal"):
+            (total_w,total_f) = self.parseTotal(index) or ("","")
+        with stage("parser.parseDate"):
+            d,m,y = self.parseDate(index) or ("","","")
+        with stage("parser.parseItems"):
+            items = self.parseItems(index) or []
 
         # create receipt
         receipt = Receipt()
@@ -54,120 +246,85 @@ class ReceiptParser(Parser):
     def normalize_text(self,text):
         return text.lower()
 
-    def parseTotal(self,text):
-        """ looks for the total price in the normalized text given, returns none if none found, or tuple of whole and fractional part of the total """
-        
-        # identify all prices
-        prices = self.findPriceMatches(text)
+    def scanText(self,text):
+        """ returns the TextIndex of the normalized text, the price and date regexes are matched against each line """
+        if isinstance(text,TextIndex):
+            return text
 
-        # if no prices found return no total
-        if len(prices) == 0:
-            return None
+        lines = text.splitlines()
+        prices = []
+        dates = []
+        for l in lines:
+            prices.append([PriceMatch(m.start(),m.end(),m.group("w"),m.group("f")) for m in self.price_pattern.finditer(l)])
+            dates.append([DateMatch(m.start(),m.end(),m.group("d"),m.group("m"),m.group("y")) for m in self.date_pattern.finditer(l)])
+
+        return TextIndex(lines,prices,dates)
+
+    def parseTotal(self,text):
+        """ looks for the total price in the normalized text (or its TextIndex) given, returns none if none found, or tuple of whole and fractional part of the total """
+        index = self.scanText(text)
 
         # find biggest price    
         max = 0
         max_match = None
-        for match in prices:
-            if match["value"] > max:
-                max = match["value"]
-                max_match = match["match"]
+        for line_prices in index.prices:
+            for match in line_prices:
+                value = match.value
+                if value > max:
+                    max = value
+                    max_match = match
         
-        return (max_match.group("w"),max_match.group("f"))
+        # if no (non zero) prices found return no total
+        if max_match is None:
+            return None
 
-        # we look for occurences of floating point formated numbers and 
+        return (max_match.whole,max_match.fractional)
     
     def parseDate(self,text):
-        """ looks for the date in the normalized text given, returns none if none found and 3-ple (d,m,y) otherwise"""
+        """ looks for the date in the normalized text (or its TextIndex) given, returns none if none found and 3-ple (d,m,y) otherwise"""
+        index = self.scanText(text)
 
-        # attempt to find date in the expected format
-        match = re.search(self.date_regex,text)
+        # first date in the expected format
+        for line_dates in index.dates:
+            if len(line_dates) > 0:
+                match = line_dates[0]
+                return (match.day,match.month,match.year)
 
-        if match is None:
-            return None
-        else:
-            d,m,y = match.group("d"),match.group("m"),match.group("y")
-            return (d,m,y)
+        return None
 
     def parseItems(self,text):
-        """ looks for the items in the normalized text given, returns none if none found """
-
-        # find first line which contains a price and try to parse each line as an item,
-        # exclude any lines with the word total or such, and try to ignore discount lines, or filler ones 
-        prices = self.findPriceMatches(text)
+        """ looks for the items in the normalized text (or its TextIndex) given, returns none if none found """
+        index = self.scanText(text)
 
         # if no prices, return none 
-        if len(prices) == 0:
+        if not any(index.prices):
             return None
-        else:
-            first_price = prices[0]
+
+        # try to parse each line with a price as an item,
+        # exclude any lines with the word total or such, and try to ignore discount lines, or filler ones 
+        items = []
+        for l,prices in zip(index.lines,index.prices):
+            # check line contains word TOTAL, if so stop
+            if "total" in l.lower():
+                break
+
+            # if no price, skip line
+            if len(prices) == 0:
+                continue
+
+            # otherwise pick last one (first one is likely price per kilo or similar)
+            price_match = prices[-1]
+            # take name to be everything in the line except price
+            name = l[0 : price_match.start] + l[price_match.end + 1:]
+            # clean up
+            name = name.strip()
             
-            # find line containing first price
-            line_no = self.findLineAtIndex(first_price["start"],text)
-            lines = text.splitlines()
-
-            items = []
-
-            for idx,l in enumerate(lines):
-                # check line contains word TOTAL, if so stop
-                if "total" in l.lower():
-                    break
-
-                # otherwise keep interpreting price-item pairs
-                prices = self.findPriceMatches(l)
-
-                # if no price, skip line
-                if len(prices) == 0:
-                    continue
-                else:
-                    # otherwise pick last one (first one is likely price per kilo or similar)
-                    price_match = prices[-1]
-                    # take name to be everything in the line except price
-                    name = l[0 : price_match["start"]] + l[price_match["end"] + 1:]
-                    # clean up
-                    name = name.strip()
-                    
-                    # create item and append
-                    item = Item()
-                    item.name = name
-                    item.price_whole_part = price_match["match"].group("w")
-                    item.price_fractional_part = price_match["match"].group("f")
-                    
-                    items.append(item)
-
-            return items
-
-
-
-    def findLineAtIndex(self,index,string):
-        """ returns line number at the given index of the given string"""
-
-        line = 0
-        curr_line_start_idx = 0
-        last_line = False
-
-        for idx,c in enumerate(string):
-            if c == '\n':
-                if last_line == True:
-                    # if we just ending this line, return
-                    return line
-                else:
-                    line+= 1
-                    curr_line_start_idx = idx
-                    continue
-
-            if idx == index:
-                last_line = True
-
-
-    def findPriceMatches(self,text):
-        """ identifies the start-end positions of each possible price found in the receipt along with their values in a list of tuples"""
-        
+            # create item and append
+            item = Item()
+            item.name = name
+            item.price_whole_part = price_match.whole
+            item.price_fractional_part = price_match.fractional
+            
+            items.append(item)
 
-        # find matches for things starting with currency sign and some digits around a dot
-        matches = re.finditer(self.price_regex, text)
-        matches = [{"start":match.start(),
-                    "end":match.end(),
-                    "value":float(match.group("w")+"."+match.group("f")),
-                    "match":match
-                } for match in matches]
-        return matches
\ No newline at end of file
+        return items
@@ -0,0 +1,130 @@
+import asyncio
+from ocr.Engines import PipedTesseractEngine
+from classes.Classes import OcrResult
+from parsing.Parsers import ReceiptParser
+from preprocessing.Processors import ArtifactRemover,TextDetector
+from pipeline.Pipelines import loadImage
+from pipeline.TieredPipelines import TieredPipeline
+import time
+
+class AsyncTesseractEngine():
+    """ runs tesseract through asyncio subprocesses with the image piped through stdin, 
+        if the awaiting task is cancelled the tesseract process is killed rather than left running 
+    """
+    def __init__(self,cmd="tesseract"):
+        self.piped = PipedTesseractEngine(cmd)
+
+    async def run(self,img,lang,config,output=None):
+        proc = await asyncio.create_subprocess_exec(*self.piped.command(lang,config,output),
+            stdin=asyncio.subprocess.PIPE,stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout,stderr = await proc.communicate(self.piped.encode(img))
+        except asyncio.CancelledError:
+            # don't leave orphaned tesseract processes behind
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+
+        if proc.returncode != 0:
+            raise RuntimeError("tesseract failed: " + stderr.decode(errors="replace").strip())
+        return stdout.decode("utf-8")
+
+    async def imageToString(self,img,lang="eng",config=""):
+        return await self.run(img,lang,config)
+
+    async def imageToData(self,img,lang="eng",config=""):
+        return OcrResult.fromTsv(await self.run(img,lang,config,"tsv"))
+
+class AsyncPipeline():
+    """
+    Asyncio counterpart of a Pipeline, CPU bound pre-processing runs in an executor (the loop's default one if None) 
+    and OCR runs in asyncio subprocesses so the event loop is never blocked. At most max_concurrency receipts are processed at once.
+    The pipeline's pre-processors are shared between concurrent receipts, which is safe for the built in ones since 
+    the OCR of ArtifactRemover and TextDetector is done here and only the (stateless) masking runs in the executor.
+    Pipelines with a cache, or parsers other than ReceiptParser, are run in the executor as a whole.
+    A TieredPipeline is run one tier at a time in the same way, its validators deciding whether the next tier runs
+    """
+    def __init__(self,pipeline,executor=None,max_concurrency=32,engine=None):
+        self.pipeline = pipeline
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.engine = engine or AsyncTesseractEngine()
+        self.semaphore = None
+
+    async def inExecutor(self,f,*args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor,f,*args)
+
+    async def preprocess(self,img,pipeline=None):
+        """ runs all the pre-processors of the pipeline (the wrapped one if None) in order, 
+            returns the processed image and the latest OCR result produced along the way or None 
+        """
+        ocr_result = None
+        for p in (pipeline or self.pipeline).pre_processors:
+            if isinstance(p,ArtifactRemover):
+                ocr_result = await self.engine.imageToData(img,lang=p.lang)
+                img = await self.inExecutor(p.removeArtifacts,img,ocr_result)
+            elif isinstance(p,TextDetector):
+                ocr_result = await self.engine.imageToData(img,lang=p.lang)
+            else:
+                img = await self.inExecutor(p.process,img)
+        return img,ocr_result
+
+    async def run(self,img):
+        """ pre-processes and parses the given grayscale image, returns the processed image and the parsed receipt """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self.semaphore:
+            if isinstance(self.pipeline,TieredPipeline):
+                return await self.runTiered(img)
+            return (await self.runPipeline(self.pipeline,img))[:2]
+
+    async def runTiered(self,img):
+        """ runs the tiers of the wrapped TieredPipeline in order, returns the processed image and receipt of the first one its validators accept """
+        tiered = self.pipeline
+        escalated_by = []
+        for i,tier in enumerate(tiered.tiers):
+            start = time.perf_counter()
+            processed,receipt,ocr_result = await self.runPipeline(tier,img)
+            failed = tiered.check(i,receipt,ocr_result,time.perf_counter() - start)
+            if len(failed) == 0:
+                tiered.accept(i,{},escalated_by)
+                return processed,receipt
+            if i == 0:
+                escalated_by = failed
+
+    async def runPipeline(self,pipeline,img):
+        """ runs a Pipeline on the image, returns the processed image, the receipt and the latest OCR result of the pre-processors or None """
+        parser = pipeline.parser
+        if pipeline.cache is not None or not isinstance(parser,ReceiptParser):
+            return await self.inExecutor(runWithOcrResult,pipeline,img)
+
+        img,ocr_result = await self.preprocess(img,pipeline)
+        if parser.reuse_ocr and ocr_result is not None:
+            text = ocr_result.text
+        elif parser.line_bands:
+            # the bands of a receipt are recognized by concurrent tesseract processes
+            bands = await self.inExecutor(parser.bandImages,img)
+            texts = await asyncio.gather(*[self.engine.imageToString(band,lang=parser.lang,config=config) for (band,config) in bands])
+            text = parser.joinBands(texts)
+        else:
+            text = await self.engine.imageToString(img,lang=parser.lang)
+        receipt = await self.inExecutor(parser.parseText,parser.normalize_text(text))
+        return img,receipt,ocr_result
+
+    async def parse(self,source):
+        """ loads the source (anything loadImage accepts) and parses it, returns the receipt """
+        img = await self.inExecutor(loadImage,source)
+        return (await self.run(img))[1]
+
+def runWithOcrResult(pipeline,img):
+    """ runs the pipeline, returns the processed image, the receipt and the pipeline's OCR result """
+    img,receipt = pipeline.run(img)
+    return img,receipt,pipeline.last_ocr_result
+
+async def parseReceiptAsync(source,pipeline):
+    """ parses the source with the given Pipeline or AsyncPipeline, plain pipelines are wrapped with the default executor and concurrency limit """
+    if not isinstance(pipeline,AsyncPipeline):
+        pipeline = AsyncPipeline(pipeline)
+    return await pipeline.parse(source)
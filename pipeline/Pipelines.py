@@ -0,0 +1,209 @@
+import os
+from parsing.Parsers import TextParser
+from profiling.Profilers import stage
+from preprocessing.Processors import preparesWholeImage
+from common.Lazy import lazyImport
+
+np = lazyImport("numpy")
+cv2 = lazyImport("cv2")
+
+# rough number of strip sized buffers alive at once while a chain of pixel-local stages runs on a strip (inputs, outputs and OpenCV's own buffers)
+TILE_COPIES = 8
+
+def mapImage(path):
+    """ memory maps a raw grayscale image, either a 2D .npy array or a binary 8 bit .pgm, so rows are only read from disk as they are used.
+        Returns None for any other file
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        img = np.load(path,mmap_mode="r")
+        return img if img.ndim == 2 else None
+
+    if ext == ".pgm":
+        with open(path,"rb") as f:
+            header = f.read(512)
+        # magic, width, height and maximum value separated by whitespace (and comments), followed by a single whitespace character
+        fields = []
+        pos = 0
+        while len(fields) < 4 and pos < len(header):
+            if header[pos:pos + 1].isspace():
+                pos += 1
+            elif header[pos:pos + 1] == b"#":
+                pos = header.find(b"\n",pos) + 1 or len(header)
+            else:
+                end = pos
+                while end < len(header) and not header[end:end + 1].isspace():
+                    end += 1
+                fields.append(header[pos:end])
+                pos = end
+        if len(fields) < 4 or fields[0] != b"P5" or int(fields[3]) > 255:
+            return None
+        return np.memmap(path,np.uint8,"r",offset=pos + 1,shape=(int(fields[2]),int(fields[1])))
+
+    return None
+
+def loadImage(source,mmap=False):
+    """ returns the source as a grayscale image, source can be a path, encoded image file contents (bytes, bytearray or memoryview),
+        a 1-D uint8 numpy buffer of encoded contents or an already decoded grayscale or BGR numpy image (also accepted as a .npy file).
+        With mmap set, paths of raw images (see mapImage) are memory mapped (read only) instead of read.
+        Raises IOError if the source can't be read or decoded
+    """
+    if isinstance(source,str) and mmap:
+        img = mapImage(source)
+        if img is not None:
+            return img
+
+    if isinstance(source,str) and source.lower().endswith(".npy"):
+        return loadImage(np.load(source))
+
+    if isinstance(source,str):
+        img = cv2.imread(source,cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise IOError("Could not find input image at:" + source)
+        return img
+
+    if isinstance(source,(bytes,bytearray,memoryview)):
+        source = np.frombuffer(source,np.uint8)
+
+    if source.ndim == 1:
+        img = cv2.imdecode(source,cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            raise IOError("Could not decode input image")
+        return img
+
+    if source.ndim == 3:
+        return cv2.cvtColor(source,cv2.COLOR_BGRA2GRAY if source.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+
+    return source
+
+def runTiled(processors,img,memory_budget):
+    """ runs a chain of pixel-local processors (see Processor.halo) on horizontal strips of the image, each extended by the rows 
+        the chain depends on so the result is the same as running it on the whole image. Strips are sized so roughly memory_budget bytes are used
+        on top of the input and output, rows of a memory mapped input are only read as their strip is processed. Returns the whole output.
+        The first processor may need to see the whole image first (see Processor.prepare), the others may not
+    """
+    processors[0].prepare(img)
+    halo = sum(p.halo() for p in processors)
+    h = img.shape[0]
+    row_bytes = img[:1].nbytes * TILE_COPIES
+    rows = max(16,memory_budget // max(1,row_bytes) - 2 * halo)
+
+    out = None
+    for y0 in range(0,h,rows):
+        y1 = min(h,y0 + rows)
+        a,b = max(0,y0 - halo),min(h,y1 + halo)
+        strip = np.ascontiguousarray(img[a:b])
+        for p in processors:
+            strip = p.processRows(strip,a)
+
+        if out is None:
+            out = np.empty((h,) + strip.shape[1:],strip.dtype)
+        out[y0:y1] = strip[y0 - a:y1 - a]
+    return out
+
+class Pipeline():
+    """
+    Runs an image through a chain of pre-processors and hands the result to a parser,
+    carrying along the OCR result of any pre-processor which performed OCR so the parser can reuse it.
+    If given a ResultCache, the pre-processed image, OCR text and receipt are cached separately, 
+    keyed by the image and the settings of the stages they depend on, so only the stages after a changed setting are recomputed
+    """
+    def __init__(self,pre_processors,parser,cache=None,memory_budget=None):
+        """ with memory_budget (bytes) set, consecutive pixel-local pre-processors are run together on strips of the image (see runTiled),
+            which bounds their memory use by the budget rather than the image size, the stages which need the whole image still hold it in memory
+        """
+        self.pre_processors = pre_processors
+        self.parser = parser
+        self.cache = cache
+        self.memory_budget = memory_budget
+        # the decisions of the adaptive pre-processors on the last image run (see Processor.report), empty if it came from the cache
+        self.last_report = {}
+        # the latest OCR result of the pre-processors on the last image run, if any
+        self.last_ocr_result = None
+
+    def fingerprint(self):
+        """ a string identifying the settings of every stage, two pipelines with the same fingerprint produce the same output """
+        return "|".join([p.fingerprint() for p in self.pre_processors] + [self.parser.fingerprint()])
+
+    def preprocess(self,img):
+        """ runs all the pre-processors in order, returns the processed image and the latest OCR result produced along the way or None """
+        ocr_result = None
+        for i,group in self.stageGroups():
+            if len(group) == 1 and (self.memory_budget is None or group[0].halo() is None):
+                with stage("{}:{}".format(i,type(group[0]).__name__)):
+                    img = group[0].process(img)
+            else:
+                with stage("{}:tiled({})".format(i,",".join(type(p).__name__ for p in group))):
+                    img = runTiled(group,img,self.memory_budget)
+
+            for p in group:
+                ocr_result = p.ocrResult() or ocr_result
+                self.last_report.update(p.report())
+
+        return img,ocr_result
+
+    def stageGroups(self):
+        """ the (index of the first,list of pre-processors) to run in turn, consecutive pixel-local pre-processors are grouped together if running tiled """
+        groups = []
+        for i,p in enumerate(self.pre_processors):
+            tiled = self.memory_budget is not None and p.halo() is not None
+            # processors which prepare on the whole image can only start a chain, their input is only whole before the chain runs
+            if tiled and len(groups) > 0 and groups[-1][2] and not preparesWholeImage(p):
+                groups[-1][1].append(p)
+            else:
+                groups.append((i,[p],tiled))
+        return [(i,group) for (i,group,tiled) in groups]
+
+    def run(self,img):
+        """ pre-processes and parses the given grayscale image, returns the processed image and the parsed receipt """
+        self.last_report = {}
+        self.last_ocr_result = None
+        if self.cache is not None:
+            return self.runCached(img)
+
+        img,ocr_result = self.preprocess(img)
+        self.last_ocr_result = ocr_result
+        with stage("parse"):
+            receipt = self.parser.parseReceipt(img,ocr_result)
+        return img,receipt
+
+    def parse(self,source):
+        """ loads the source (see loadImage) and parses it entirely in memory, returns the receipt """
+        return self.run(loadImage(source))[1]
+
+    def runCached(self,img):
+        cache = self.cache
+        img = np.ascontiguousarray(img)
+        image_key = cache.key(str(img.shape),str(img.dtype),memoryview(img).cast("B"))
+        pre_key = cache.key(image_key,*[p.fingerprint() for p in self.pre_processors])
+
+        # pre-processed image along with the ocr result
+        preprocessed = cache.get("preprocessed",pre_key)
+        if preprocessed is None:
+            preprocessed = self.preprocess(img)
+            cache.put("preprocessed",pre_key,preprocessed)
+        img,ocr_result = preprocessed
+        self.last_ocr_result = ocr_result
+
+        if not isinstance(self.parser,TextParser):
+            receipt_key = cache.key(pre_key,self.parser.fingerprint())
+            receipt = cache.get("receipt",receipt_key)
+            if receipt is None:
+                receipt = self.parser.parseReceipt(img,ocr_result)
+                cache.put("receipt",receipt_key,receipt)
+            return img,receipt
+
+        # ocr text, then the receipt parsed out of it
+        text_key = cache.key(pre_key,self.parser.ocrFingerprint())
+        text = cache.get("text",text_key)
+        if text is None:
+            text = self.parser.extractText(img,ocr_result)
+            cache.put("text",text_key,text)
+
+        receipt_key = cache.key(text_key,self.parser.fingerprint())
+        receipt = cache.get("receipt",receipt_key)
+        if receipt is None:
+            receipt = self.parser.parseText(text)
+            cache.put("receipt",receipt_key,receipt)
+
+        return img,receipt
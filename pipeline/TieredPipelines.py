@@ -0,0 +1,129 @@
+from abc import ABC, abstractmethod
+from pipeline.Pipelines import loadImage
+from profiling.Profilers import stage
+from decimal import Decimal
+import time
+
+class Validator(ABC):
+    """ a check of whether a receipt was likely parsed correctly, used to decide if a receipt needs a more expensive pipeline """
+
+    @abstractmethod
+    def validate(self,receipt,ocr_result):
+        """ returns True if the receipt passes the check, ocr_result is the OCR result of the pipeline's pre-processors or None """
+        pass
+
+    def fingerprint(self):
+        return type(self).__name__ + repr(sorted(vars(self).items()))
+
+class DateFound(Validator):
+    """ passes receipts with a date """
+
+    def validate(self,receipt,ocr_result):
+        return receipt.day not in (None,"") and receipt.month not in (None,"") and receipt.year not in (None,"")
+
+class TotalMatchesItems(Validator):
+    """ passes receipts with items whose prices sum up to the total, within tolerance (a fraction of the total) """
+
+    def __init__(self,tolerance=0.02):
+        self.tolerance = tolerance
+
+    def validate(self,receipt,ocr_result):
+        total = receipt.total
+        if total is None or len(receipt.items) == 0:
+            return False
+
+        prices = [i.price for i in receipt.items]
+        if None in prices:
+            return False
+        return abs(sum(prices) - total) <= Decimal(str(self.tolerance)) * total + Decimal("0.005")
+
+class MinConfidence(Validator):
+    """ passes receipts whose OCR result has a mean word confidence (0-100) of at least threshold, 
+        fails if the pipeline has no OCR result (i.e. it has no pre-processor which runs OCR) 
+    """
+
+    def __init__(self,threshold=70):
+        self.threshold = threshold
+
+    def validate(self,receipt,ocr_result):
+        if ocr_result is None:
+            return False
+        confidence = ocr_result.meanConfidence()
+        return confidence is not None and confidence >= self.threshold
+
+class TieredPipeline():
+    """
+    Runs a receipt through a list of pipelines ordered from the cheapest to the most expensive, stopping at the first 
+    whose receipt passes every validator (the last pipeline's receipt is always accepted). 
+    Keeps count of the receipts accepted by each tier, the validators failed and the time spent, see stats()
+    """
+    def __init__(self,tiers,validators,names=None):
+        """ tiers is the list of Pipelines, validators the list of Validators and names the names of the tiers used in reports (tier0, tier1.. by default) """
+        self.tiers = tiers
+        self.validators = validators
+        self.names = names or ["tier" + str(i) for i in range(len(tiers))]
+        self.counts = {
+            "accepted":[0] * len(tiers),
+            "runs":[0] * len(tiers),
+            "seconds":[0.0] * len(tiers),
+            "failed":[{type(v).__name__:0 for v in validators} for _ in tiers]
+        }
+        self.last_report = {}
+
+    def fingerprint(self):
+        """ a string identifying the settings of every tier and validator """
+        return "||".join([t.fingerprint() for t in self.tiers] + [v.fingerprint() for v in self.validators])
+
+    def run(self,img):
+        """ returns the processed image and receipt of the first tier whose receipt passes the validators """
+        escalated_by = []
+        for i,tier in enumerate(self.tiers):
+            start = time.perf_counter()
+            with stage("tier:" + self.names[i]):
+                processed,receipt = tier.run(img)
+
+            failed = self.check(i,receipt,tier.last_ocr_result,time.perf_counter() - start)
+            if len(failed) == 0:
+                self.accept(i,tier.last_report,escalated_by)
+                return processed,receipt
+            # validators which failed on the cheapest tier
+            if i == 0:
+                escalated_by = failed
+
+    def check(self,i,receipt,ocr_result,seconds):
+        """ counts a run of tier i which took seconds, returns the names of the validators its receipt failed, 
+            none for the last tier whose receipt is accepted whatever its result 
+        """
+        self.counts["runs"][i] += 1
+        self.counts["seconds"][i] += seconds
+        failed = [type(v).__name__ for v in self.validators if not v.validate(receipt,ocr_result)] if i < len(self.tiers) - 1 else []
+        for name in failed:
+            self.counts["failed"][i][name] += 1
+        if len(failed) == 0:
+            self.counts["accepted"][i] += 1
+        return failed
+
+    def accept(self,i,report,escalated_by):
+        """ sets last_report once the receipt of tier i is accepted, report being the tier's own report and escalated_by the validators failed on the first tier """
+        self.last_report = dict(report,tier=self.names[i])
+        if i > 0:
+            self.last_report["escalated_by"] = ",".join(escalated_by)
+
+    def parse(self,source):
+        """ loads the source (see loadImage) and parses it, returns the receipt """
+        return self.run(loadImage(source))[1]
+
+    def stats(self):
+        """ per tier counts of the receipts run and accepted, the hit rate (accepted out of run), 
+            the fraction of all receipts accepted, the number of failures of each validator and the mean seconds per run
+        """
+        total = sum(self.counts["accepted"])
+        return [{
+            "tier":name,
+            "runs":self.counts["runs"][i],
+            "accepted":self.counts["accepted"][i],
+            "hit_rate":self.counts["accepted"][i] / self.counts["runs"][i] if self.counts["runs"][i] > 0 else None,
+            "share":self.counts["accepted"][i] / total if total > 0 else None,
+            "failed":self.counts["failed"][i],
+            "mean_seconds":self.counts["seconds"][i] / self.counts["runs"][i] if self.counts["runs"][i] > 0 else None
+        } for i,name in enumerate(self.names)]
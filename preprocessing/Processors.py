@@ -1,96 +1,395 @@
 from abc import ABC, abstractmethod
-import cv2 
-import numpy as np
-import pytesseract
-from pytesseract import Output
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from ocr.Engines import getDefaultEngine
+from cache.Caches import constructorSettings
+from profiling.Profilers import annotate
+from common.Lazy import lazyImport
+
+cv2 = lazyImport("cv2")
+np = lazyImport("numpy")
+
+def asStack(images):
+    """ returns the images as a contiguous N x H x W array, or None if they don't all have the same shape and type """
+    if isinstance(images,np.ndarray) and images.ndim == 3:
+        return np.ascontiguousarray(images)
+    if len(images) == 0 or any(img.ndim != 2 or img.shape != images[0].shape or img.dtype != images[0].dtype for img in images):
+        return None
+    return np.stack(images)
+
+# OpenCV's thread count is process wide, it is turned down while any batchMap runs and restored once the last one finishes
+opencv_threads = {"lock":threading.Lock(),"users":0,"saved":None}
+
+def batchMap(f,images):
+    """ maps f over the images on a thread pool, one image per core. OpenCV's own threading is turned off meanwhile
+        (process wide, so this is meant for throughput oriented batch runs) since the images already keep every core busy
+    """
+    with opencv_threads["lock"]:
+        if opencv_threads["users"] == 0:
+            opencv_threads["saved"] = cv2.getNumThreads()
+            cv2.setNumThreads(1)
+        opencv_threads["users"] += 1
+    try:
+        with ThreadPoolExecutor(min(len(images),os.cpu_count() or 1) or 1) as pool:
+            return list(pool.map(f,images))
+    finally:
+        with opencv_threads["lock"]:
+            opencv_threads["users"] -= 1
+            if opencv_threads["users"] == 0:
+                cv2.setNumThreads(opencv_threads["saved"])
 
 class Processor(ABC):
     @abstractmethod
     def process(self,img):  
         pass
 
+    def processBatch(self,images):
+        """ processes a list (or N x H x W array) of images, returns the list of results in the same order.
+            Processors override this where a batch can be done faster than one image at a time, with identical results
+        """
+        return [self.process(img) for img in images]
+
+    def ocrResult(self):
+        """ the OCR result obtained during the last call to process by processors which run OCR, None for all others """
+        return None
+
+    def report(self):
+        """ a dictionary of the decisions made during the last call to process by processors which adapt to the image, e.g. whether to denoise, empty for all others """
+        return {}
+
+    def halo(self):
+        """ for pixel-local processors, the number of rows above and below a row of the image which its output depends on, 
+            such processors can be run on overlapping horizontal strips of the image with the same result. None for processors which need the whole image
+        """
+        return None
+
+    def prepare(self,img):
+        """ for pixel-local processors whose output also depends on something found in the whole image (e.g. the text boxes OCR finds),
+            finds it ahead of the image being processed in strips with processRows. Processors which override this are always the first of a tiled chain
+        """
+        pass
+
+    def processRows(self,strip,y0):
+        """ processes a horizontal strip of the image starting at row y0, for pixel-local processors run on strips (see halo), 
+            after prepare was called with the whole image. The same as process for processors which don't override prepare
+        """
+        return self.process(strip)
+
+    def fingerprint(self):
+        """ a string identifying the processor and its settings, used in cache keys """
+        return type(self).__name__ + repr(constructorSettings(self))
+
+def preparesWholeImage(processor):
+    """ whether the processor has to see the whole image before it is run on strips of it (see Processor.prepare) """
+    return type(processor).prepare is not Processor.prepare
+
+class RoiCropper(Processor):
+    """ crops the image to the receipt, found as the largest bright region of a thumbnail, so later stages only process the paper """
+
+    def __init__(self,thumbnail_size=256,min_area_frac=0.1,margin_frac=0.02,copy=True):
+        """ thumbnail_size is the longest side of the thumbnail the receipt is searched for in,
+            the image is left as is if the largest bright region covers less than min_area_frac of it,
+            margin_frac of the image size is kept around the region on each side.
+            Unless copy is set the crop is a view of the image, so the crop of a memory mapped scan is only read as later stages run on strips of it
+        """
+        self.thumbnail_size = thumbnail_size
+        self.min_area_frac = min_area_frac
+        self.margin_frac = margin_frac
+        self.copy = copy
+        self.roi = None
+
+    def fingerprint(self):
+        # a view and a copy hold the same pixels
+        return type(self).__name__ + repr(constructorSettings(self,exclude=("copy",)))
+
+    def findRoi(self,img):
+        """ returns the x0,y0,x1,y1 (exclusive) bounds of the receipt in the image, or None if no region is large enough """
+        h,w = img.shape[:2]
+        scale = min(1.0,self.thumbnail_size / max(h,w))
+        thumb = cv2.resize(img,(max(1,round(w * scale)),max(1,round(h * scale))),interpolation=cv2.INTER_AREA) if scale < 1 else img
+
+        # paper is brighter than the background, closing fills in the (dark) text so it stays part of the paper
+        thumb = cv2.GaussianBlur(thumb,(5,5),0)
+        ret,paper = cv2.threshold(thumb,0,255,cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        paper = cv2.morphologyEx(paper,cv2.MORPH_CLOSE,np.ones((5,5),np.uint8))
+
+        contours,hierarchy = cv2.findContours(paper,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)
+        if len(contours) == 0:
+            return None
+        largest = max(contours,key=cv2.contourArea)
+        if cv2.contourArea(largest) < self.min_area_frac * paper.shape[0] * paper.shape[1]:
+            return None
+
+        x,y,cw,ch = cv2.boundingRect(largest)
+        mx,my = self.margin_frac * w,self.margin_frac * h
+        return (max(0,int(x / scale - mx)),max(0,int(y / scale - my)),
+            min(w,int(np.ceil((x + cw) / scale + mx))),min(h,int(np.ceil((y + ch) / scale + my))))
+
+    def process(self,img):
+        # the crop works off a local, self.roi is only kept for reporting since the cropper may be shared between threads
+        roi = self.findRoi(img)
+        self.roi = roi
+        if roi is None:
+            return img
+
+        x0,y0,x1,y1 = roi
+        if (x0,y0,x1,y1) == (0,0,img.shape[1],img.shape[0]):
+            return img
+        return np.ascontiguousarray(img[y0:y1,x0:x1]) if self.copy else img[y0:y1,x0:x1]
+
 class Denoiser(Processor):
     """ Attempts to remove noise from receipt using thresholding and denoising """
-    def __init__(self,lo_intensity_thresh=120):
+    def __init__(self,lo_intensity_thresh=120,adaptive=False,skip_below=0.01,speckle_below=0.1,speckle_size=2,nl_means_h=30,tiles=1):
+        """ With adaptive set, the noise of the image is estimated as the fraction of the dark pixels of the thresholded image which have no dark neighbours,
+            below skip_below the thresholded image is returned as is, below speckle_below dark blobs of at most speckle_size pixels are removed,
+            otherwise the grayscale image is denoised with non-local means (with strength nl_means_h, split into tiles horizontal strips run in parallel) before thresholding.
+            Non-local means on the binary thresholded image (what the non adaptive mode does) leaves it unchanged, so skipping it gives the same output.
+            The decision for the last image is available via report()
+        """
         self.lo_intensity_thresh = lo_intensity_thresh
+        self.adaptive = adaptive
+        self.skip_below = skip_below
+        self.speckle_below = speckle_below
+        self.speckle_size = speckle_size
+        self.nl_means_h = nl_means_h
+        self.tiles = tiles
+        self.decision = {}
 
     def process(self,img):
         ret,thresh = cv2.threshold(img,self.lo_intensity_thresh,255,cv2.THRESH_BINARY)
+        if self.adaptive:
+            return self.adaptiveDenoise(img,thresh)
+
         thresh = cv2.fastNlMeansDenoising(thresh)
 
         return thresh
 
-class ArtifactRemover():
-    """ attempts to remove non-textual data from the image """
+    def processBatch(self,images):
+        stack = asStack(images)
+        if stack is None or self.adaptive:
+            return super().processBatch(images)
+
+        # a single threshold over all the images stacked into one tall image, then denoising of each image in parallel
+        n,h,w = stack.shape
+        ret,thresh = cv2.threshold(stack.reshape(n * h,w),self.lo_intensity_thresh,255,cv2.THRESH_BINARY)
+        return batchMap(cv2.fastNlMeansDenoising,list(thresh.reshape(n,h,w)))
+
+    def report(self):
+        return self.decision
+
+    def halo(self):
+        # the noise estimate of the adaptive mode is over the whole image, non-local means looks at a 21 pixel search window of 7 pixel templates
+        if self.adaptive:
+            return None
+        return 7 // 2 + 21 // 2
+
+    def noiseEstimate(self,thresh):
+        """ the fraction of dark pixels of the thresholded image with no dark pixel among their 8 neighbours """
+        dark = (thresh == 0).view(np.uint8)
+        neighbours = cv2.filter2D(dark,cv2.CV_16S,np.ones((3,3),np.float32),borderType=cv2.BORDER_CONSTANT)
+        dark_count = int(dark.sum())
+        if dark_count == 0:
+            return 0.0
+        return int(np.count_nonzero((neighbours == 1) & (dark == 1))) / dark_count
+
+    def removeSpeckles(self,thresh):
+        """ whitens the dark connected blobs of at most speckle_size pixels """
+        count,labels,stats,centroids = cv2.connectedComponentsWithStats(255 - thresh,connectivity=8)
+        small = stats[:,cv2.CC_STAT_AREA] <= self.speckle_size
+        small[0] = False
+        out = thresh.copy()
+        out[small[labels]] = 255
+        return out
+
+    def nlMeans(self,img):
+        """ non-local means denoising of the grayscale image, in horizontal strips run in parallel if tiles > 1. 
+            Strips overlap by the reach of the search and template windows so the result matches denoising the whole image
+        """
+        if self.tiles <= 1:
+            return cv2.fastNlMeansDenoising(img,h=self.nl_means_h)
+
+        # default template window of 7 and search window of 21
+        halo = 7 // 2 + 21 // 2
+        bounds = np.linspace(0,img.shape[0],self.tiles + 1).astype(int)
+        strips = [(max(0,y0 - halo),y0,y1,min(img.shape[0],y1 + halo)) for y0,y1 in zip(bounds[:-1],bounds[1:]) if y1 > y0]
+        denoised = batchMap(lambda s: cv2.fastNlMeansDenoising(img[s[0]:s[3]],h=self.nl_means_h),strips)
+
+        out = np.empty_like(img)
+        for (a,y0,y1,b),strip in zip(strips,denoised):
+            out[y0:y1] = strip[y0 - a:y1 - a]
+        return out
+
+    def adaptiveDenoise(self,img,thresh):
+        noise = self.noiseEstimate(thresh)
+        if noise < self.skip_below:
+            mode = "skip"
+        elif noise < self.speckle_below:
+            mode = "speckle"
+            thresh = self.removeSpeckles(thresh)
+        else:
+            mode = "nl_means"
+            ret,thresh = cv2.threshold(self.nlMeans(img),self.lo_intensity_thresh,255,cv2.THRESH_BINARY)
+
+        self.decision = {"denoise":mode,"noise":noise}
+        annotate(**self.decision)
+        return thresh
+
+class ArtifactRemover(Processor):
+    """ attempts to remove non-textual data from the image, the word boxes found are kept and can be retrieved via ocrResult """
 
 
-    def __init__(self,text_area_frac_threshold_lo=0.01,text_area_frac_threshold_hi=0.95):
-       """  the bounding box area cutoff argument determines the cutoff point (<,>) for text bounding boxes to be included as text and not treated as noise when they're above the given percentage of the total area of the image"""
+    def __init__(self,text_area_frac_threshold_lo=0.01,text_area_frac_threshold_hi=0.95,lang="eng",engine=None):
+       """  the bounding box area cutoff argument determines the cutoff point (<,>) for text bounding boxes to be included as text and not treated as noise when they're above the given percentage of the total area of the image
+            lang is the tesseract language code used to find the text, this should match the parser's if its OCR result is to be reused
+            engine is the OcrEngine used, None uses the default engine of the process"""
+       self.lang = lang
+       self.engine = engine or getDefaultEngine()
        self.text_area_frac_threshold_lo = text_area_frac_threshold_lo
        self.text_area_frac_threshold_hi = text_area_frac_threshold_hi
+       self.ocr_result = None
+       self.boxes = None
+
+    def ocrResult(self):
+        return self.ocr_result
 
     def process(self,img):
 
         # find text and remove things which are not in its bounding boxes
-        d = pytesseract.image_to_data(img, output_type=Output.DICT)
-        n_boxes = len(d['level'])
-
-
-        total_mask = np.zeros(img.shape,np.uint8)
-        img_area = img.shape[0] * img.shape[1]
-
-        for i in range(n_boxes):
-            (x, y, w, h) = (d['left'][i], d['top'][i], d['width'][i], d['height'][i])    
-            
+        self.ocr_result = self.engine.imageToData(img,lang=self.lang)
+        return self.removeArtifacts(img,self.ocr_result)
+
+    def halo(self):
+        # once the text boxes are found, the masking of each row only depends on the row
+        return 0
+
+    def prepare(self,img):
+        self.ocr_result = self.engine.imageToData(img,lang=self.lang)
+        self.boxes = self.textBoxes(img.shape,self.ocr_result)
+
+    def processRows(self,strip,y0):
+        return self.maskRows(strip,y0,self.boxes)
+
+    def textBoxes(self,shape,ocr_result):
+        """ returns the x0,y0,x1,y1 arrays of the (exclusive, clipped to the image) corners of the boxes in the ocr result which are within the area range """
+        d = ocr_result.data
+        x = np.asarray(d['left'],dtype=np.int64)
+        y = np.asarray(d['top'],dtype=np.int64)
+        w = np.asarray(d['width'],dtype=np.int64)
+        h = np.asarray(d['height'],dtype=np.int64)
+
+        # ignore bounding boxes outside some % of the images area range set
+        img_area = shape[0] * shape[1]
+        area = w * h
+        keep = (area >= self.text_area_frac_threshold_lo * img_area) & (area <= self.text_area_frac_threshold_hi * img_area)
+        x,y,w,h = x[keep],y[keep],w[keep],h[keep]
+
+        # boxes include their far edge, same as a filled cv2.rectangle from (x,y) to (x+w,y+h)
+        return (np.clip(x,0,shape[1]),np.clip(y,0,shape[0]),
+            np.clip(x + w + 1,0,shape[1]),np.clip(y + h + 1,0,shape[0]))
+
+    def removeArtifacts(self,img,ocr_result):
+        """ whitens everything in the image outside of the text boxes of the given ocr result """
+
+        return self.maskRows(img,0,self.textBoxes(img.shape,ocr_result))
+
+    def maskRows(self,strip,y0,boxes):
+        """ whitens everything outside of the boxes (see textBoxes) in the rows of the image starting at row y0 """
+
+        # the result is white everywhere except inside text boxes, where the image is copied over.
+        # Slicing a single preallocated array is much cheaper than drawing each box on its own mask, and needs no full size mask
+        out = np.full(strip.shape,255,strip.dtype)
+        x0,b0,x1,b1 = boxes
+        b0 = np.clip(b0 - y0,0,strip.shape[0])
+        b1 = np.clip(b1 - y0,0,strip.shape[0])
+        for (a,b,c,e) in zip(x0.tolist(),b0.tolist(),x1.tolist(),b1.tolist()):
+            if b < e:
+                out[b:e,a:c] = strip[b:e,a:c]
+        return out
+
+class TextDetector(Processor):
+    """ runs OCR on the image without changing it, so the word boxes and confidences can be retrieved via ocrResult and reused by the parser """
+
+    def __init__(self,lang="eng",engine=None):
+        """ lang is the tesseract language code, engine the OcrEngine used (None uses the default engine of the process) """
+        self.lang = lang
+        self.engine = engine or getDefaultEngine()
+        self.ocr_result = None
+
+    def ocrResult(self):
+        return self.ocr_result
 
-            # ignore bounding boxes outside some % of the images area range set
-            area = w*h
-            if area < self.text_area_frac_threshold_lo * img_area or area > self.text_area_frac_threshold_hi * img_area:
-                continue
-
-            min_vals = (min(x,x + w),max(x,x+w),min(y,y+h),max(y,y+h))
-            mask = np.zeros(img.shape,np.uint8)
-            mask = cv2.rectangle(mask,(x,y),(x+w,y+h),(255),thickness=cv2.FILLED)
-
-            total_mask = cv2.bitwise_or(total_mask,mask)
-
-        # leave only mask in
-        n_img = cv2.bitwise_and(img,total_mask)
-        
-        # make background white
-        bg = 255 - total_mask
-        n_img = cv2.bitwise_or(n_img,bg) 
-
-        return n_img
+    def process(self,img):
+        self.ocr_result = self.engine.imageToData(img,lang=self.lang)
+        return img
 
 class Deskewer(Processor):
     """ tries to straighten out the text in the given image"""
 
-    def __init__(self,text_area_frac_threshold=0.05):
+    def __init__(self,text_area_frac_threshold=0.05,estimation_scale=1.0,angle_tolerance=0.0):
+        """ estimation_scale is the factor by which the image is downsampled before estimating the skew angle (with kernels scaled to match),
+            the rotation itself is always done at full resolution. Images skewed by less than angle_tolerance degrees are left as they are
+        """
         self.text_area_frac_threshold = text_area_frac_threshold
+        self.estimation_scale = estimation_scale
+        self.angle_tolerance = angle_tolerance
 
     def process(self,img):
         return self.deskew(img)
 
+    def processBatch(self,images):
+        stack = asStack(images)
+        if stack is None:
+            return super().processBatch(images)
+
+        # estimation and rotation run in parallel over the images, the rotation centers are found for the whole stack at once
+        angles = batchMap(self.getSkewAngle,list(stack))
+        centers = self.centers(stack)
+        rotate = [i for i,angle in enumerate(angles) if abs(angle) >= self.angle_tolerance]
+        rotated = batchMap(lambda i: self.rotateImage(stack[i],-1.0 * angles[i],centers[i]),rotate)
+
+        out = list(stack)
+        for i,img in zip(rotate,rotated):
+            out[i] = img
+        return out
+
+    def centers(self,stack):
+        """ the integer centers of mass of each image of an N x H x W stack, equal to the ones computed by rotateImage """
+        n,h,w = stack.shape
+        m00 = stack.sum(axis=(1,2),dtype=np.int64).astype(np.float64)
+        m10 = stack.sum(axis=1,dtype=np.int64) @ np.arange(w,dtype=np.int64)
+        m01 = stack.sum(axis=2,dtype=np.int64) @ np.arange(h,dtype=np.int64)
+        return [(int(x),int(y)) for (x,y) in zip((m10 / m00).tolist(),(m01 / m00).tolist())]
+
+    def scaledKernelSize(self,size,odd=False):
+        """ scales a kernel dimension tuned for full resolution to the estimation scale, 
+            it is the reach of the kernel beyond its center pixel (size - 1) which scales with the image
+        """
+        size = int(round((size - 1) * self.estimation_scale)) + 1
+        if odd and size % 2 == 0:
+            size += 1
+        return size
+
     def getSkewAngle(self,cvImage) -> float:
         """ Calculate skew angle of an image, modified from:  https://becominghuman.ai/how-to-automatically-deskew-straighten-a-text-image-using-opencv-a0c30aed83df"""
         
-        # Prep image, copy, convert to gray scale, blur, and threshold
-        newImage = cvImage.copy()
+        # Prep image, downsample, blur, and threshold, none of the steps modify the input so no copy is needed
+        if self.estimation_scale < 1.0:
+            cvImage = cv2.resize(cvImage,None,fx=self.estimation_scale,fy=self.estimation_scale,interpolation=cv2.INTER_AREA)
         img_area = cvImage.shape[:2][0] * cvImage.shape[:2][1]
 
-        blur = cv2.GaussianBlur(newImage, (9, 9), 0)
+        blur_size = self.scaledKernelSize(9,odd=True)
+        blur = cv2.GaussianBlur(cvImage, (blur_size, blur_size), 0)
         thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
 
         # Apply dilate to merge text into meaningful lines/paragraphs.
         # Use larger kernel on X axis to merge characters into single line, cancelling out any spaces.
         # But use smaller kernel on Y axis to separate between different blocks of text
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (30, 5))
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (self.scaledKernelSize(30), self.scaledKernelSize(5)))
         dilate = cv2.dilate(thresh, kernel, iterations=5)
 
-        # Find all contours
+        # Find all contours, their order doesn't matter since we look for the most skewed one
         contours, hierarchy = cv2.findContours(dilate, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        contours = sorted(contours, key = cv2.contourArea, reverse = True)
 
         # Find most skewed contour and determine angle
         max_skew_ang_abs = 0
@@ -117,26 +416,38 @@ class Deskewer(Processor):
             angle = 90 + angle
         return -1.0 * angle
 
-    def rotateImage(self,cvImage, angle: float):
-        """ Rotate the image around its center """
+    def rotateImage(self,cvImage, angle: float, center=None):
+        """ Rotate the image around its center of mass (or the given center) """
 
-        M = cv2.moments(cvImage)
-        cX = int(M["m10"]/M["m00"])
-        cY = int(M["m01"]/M["m00"])
+        if center is None:
+            M = cv2.moments(cvImage)
+            cX = int(M["m10"]/M["m00"])
+            cY = int(M["m01"]/M["m00"])
+            center = (cX, cY)
 
-        newImage = cvImage.copy()
-        (h, w) = newImage.shape[:2]
-        center = (cX, cY)
+        # warpAffine writes to a new image, the input is left untouched
+        (h, w) = cvImage.shape[:2]
         M = cv2.getRotationMatrix2D(center, angle, 1.0)
-        newImage = cv2.warpAffine(newImage, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT,borderValue=255)
-        return newImage
+        return cv2.warpAffine(cvImage, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT,borderValue=255)
 
 
     def deskew(self,cvImage):
         """ Deskew image """
         angle = self.getSkewAngle(cvImage)
+        if abs(angle) < self.angle_tolerance:
+            return cvImage
         return self.rotateImage(cvImage, -1.0 * angle)
 
+# rectangular kernels shared by all morphology stages, they are never written to
+kernels = {}
+
+def rectKernel(kernel_shape):
+    """ returns the cached all ones kernel of the given shape """
+    kernel = kernels.get(tuple(kernel_shape))
+    if kernel is None:
+        kernel = kernels[tuple(kernel_shape)] = np.ones(kernel_shape, np.uint8)
+    return kernel
+
 class Dilater(Processor):
     """ boldens the contours present in the image """
 
@@ -147,8 +458,10 @@ class Dilater(Processor):
     def process(self,img):
 
         # since our letters are black and not white, erosion becomes dilation
-        kernel = np.ones(self.kernel_shape, np.uint8) 
-        return cv2.erode(img,kernel,iterations=self.iterations)
+        return cv2.erode(img,rectKernel(self.kernel_shape),iterations=self.iterations)
+
+    def halo(self):
+        return (self.kernel_shape[0] - 1) * self.iterations
 
 class Eroder(Processor):
     """ shrinks the contours present in the image, good for removing small noises """
@@ -160,6 +473,93 @@ class Eroder(Processor):
     def process(self,img):
 
         # since our letters are black and not white, erosion becomes dilation
-        kernel = np.ones(self.kernel_shape, np.uint8) 
-        return cv2.dilate(img,kernel,iterations=self.iterations)
+        return cv2.dilate(img,rectKernel(self.kernel_shape),iterations=self.iterations)
+
+    def halo(self):
+        return (self.kernel_shape[0] - 1) * self.iterations
+
+class MorphologyPipeline(Processor):
+    """ 
+    runs a sequence of Dilater/Eroder stages as a single processor, producing the exact same output with fewer passes:
+    consecutive identical operations are merged into one with the summed iterations, 
+    and erosions followed by equal dilations (or the reverse) become a single morphological opening (closing).
+    Intermediate results go to at most two buffers per thread, reused between calls on images of the same size
+    """
+
+    def __init__(self,ops):
+        """ ops is a list of Dilater and Eroder processors, or of ("erode"|"dilate",kernel_shape,iterations) tuples 
+            in OpenCV's terms (remember the text is black, so a Dilater erodes)
+        """
+        self.ops = [self.asOp(op) for op in ops]
+        self.plan = self.collapse(self.ops)
+        self.buffers = threading.local()
+
+    def stages(self):
+        """ the ops as the equivalent Dilater and Eroder processors, in order """
+        return [Dilater(iterations=iterations,kernel_shape=kernel_shape) if name == "erode" else Eroder(iterations=iterations,kernel_shape=kernel_shape)
+            for (name,kernel_shape,iterations) in self.ops]
+
+    def asOp(self,op):
+        if isinstance(op,Dilater):
+            return ("erode",tuple(op.kernel_shape),op.iterations)
+        if isinstance(op,Eroder):
+            return ("dilate",tuple(op.kernel_shape),op.iterations)
+
+        (name,kernel_shape,iterations) = op
+        if name not in ("erode","dilate"):
+            raise ValueError("unknown morphology operation: " + str(name))
+        return (name,tuple(kernel_shape),iterations)
+
+    def collapse(self,ops):
+        """ returns the list of (cv2 morphology op,kernel_shape,iterations) equivalent to the ops """
+
+        # merge runs of the same operation, OpenCV iterates a rectangular kernel by growing it so this is exact
+        merged = []
+        for (name,kernel_shape,iterations) in ops:
+            if iterations <= 0:
+                continue
+            if len(merged) > 0 and merged[-1][0] == name and merged[-1][1] == kernel_shape:
+                merged[-1] = (name,kernel_shape,merged[-1][2] + iterations)
+            else:
+                merged.append((name,kernel_shape,iterations))
+
+        # pair up erode->dilate (opening) and dilate->erode (closing) with the same kernel and iterations
+        plan = []
+        i = 0
+        while i < len(merged):
+            (name,kernel_shape,iterations) = merged[i]
+            if i + 1 < len(merged) and merged[i + 1][1:] == (kernel_shape,iterations):
+                plan.append((cv2.MORPH_OPEN if name == "erode" else cv2.MORPH_CLOSE,kernel_shape,iterations))
+                i += 2
+            else:
+                plan.append((cv2.MORPH_ERODE if name == "erode" else cv2.MORPH_DILATE,kernel_shape,iterations))
+                i += 1
+        return plan
+
+    def halo(self):
+        # openings and closings are two passes
+        return sum((kernel_shape[0] - 1) * iterations * (2 if op in (cv2.MORPH_OPEN,cv2.MORPH_CLOSE) else 1) for (op,kernel_shape,iterations) in self.plan)
+
+    def buffer(self,idx,img):
+        """ the intermediate buffer of the given index (0 or 1) for images like img, reused between calls on the same thread.
+            Only one buffer is kept per index, it is replaced when an image of a different shape or type comes along
+        """
+        buffers = getattr(self.buffers,"arrays",None)
+        if buffers is None:
+            buffers = self.buffers.arrays = [None,None]
+        buf = buffers[idx]
+        if buf is None or buf.shape != img.shape or buf.dtype != img.dtype:
+            buf = buffers[idx] = np.empty_like(img)
+        return buf
 
+    def process(self,img):
+        if len(self.plan) == 0:
+            return img
+
+        src = img
+        for i,(op,kernel_shape,iterations) in enumerate(self.plan):
+            # the last stage writes to a fresh array since it is handed to the caller, the others ping-pong between two buffers
+            dst = np.empty_like(img) if i == len(self.plan) - 1 else self.buffer(i % 2,img)
+            cv2.morphologyEx(src,op,rectKernel(kernel_shape),dst=dst,iterations=iterations)
+            src = dst
+        return src
@@ -0,0 +1,101 @@
+import contextlib
+import contextvars
+import time
+import tracemalloc
+
+# the profiler of the image being processed in the current thread or task, if any
+active_profiler = contextvars.ContextVar("active_profiler",default=None)
+
+# shared do-nothing context handed out when profiling is off, so disabled instrumentation costs a single lookup
+disabled = contextlib.nullcontext()
+
+def stage(name):
+    """ context manager recording the named stage on the active profiler, does nothing when no profiler is active """
+    profiler = active_profiler.get()
+    if profiler is None:
+        return disabled
+    return profiler.stage(name)
+
+def annotate(**fields):
+    """ adds the fields to the record of the innermost stage of the active profiler, e.g. to note a decision made by that stage, does nothing when no profiler is active """
+    profiler = active_profiler.get()
+    if profiler is not None:
+        profiler.annotate(**fields)
+
+class Profiler():
+    """
+    Records the wall time, cpu time and (optionally) peak memory of each stage run while it is active,
+    peak memory is what tracemalloc sees, i.e. python and numpy allocations (including OpenCV outputs) but not OpenCV's internal buffers or tesseract.
+    Stages can be nested, e.g. an OCR call inside a pre-processor
+    """
+    def __init__(self,track_memory=False):
+        self.track_memory = track_memory
+        self.records = []
+        self.depth = 0
+        self.memory_stack = []
+        self.open_records = []
+
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def activated(self):
+        """ makes this the active profiler for the duration of the context """
+        token = active_profiler.set(self)
+        try:
+            yield self
+        finally:
+            active_profiler.reset(token)
+
+    def annotate(self,**fields):
+        """ adds the fields to the record of the innermost stage which is running """
+        if len(self.open_records) > 0:
+            self.open_records[-1].update(fields)
+
+    @contextlib.contextmanager
+    def stage(self,name):
+        record = {"stage":name,"depth":self.depth}
+        self.records.append(record)
+        self.open_records.append(record)
+        self.depth += 1
+
+        if self.track_memory:
+            current,peak = tracemalloc.get_traced_memory()
+            # let the enclosing stage know about the peak so far before resetting it for this one
+            if len(self.memory_stack) > 0:
+                self.memory_stack[-1][1] = max(self.memory_stack[-1][1],peak)
+            tracemalloc.reset_peak()
+            self.memory_stack.append([current,0])
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            self.depth -= 1
+            self.open_records.pop()
+
+            if self.track_memory:
+                start,inner_peak = self.memory_stack.pop()
+                peak = max(inner_peak,tracemalloc.get_traced_memory()[1])
+                record["peak_memory"] = peak - start
+                if len(self.memory_stack) > 0:
+                    self.memory_stack[-1][1] = max(self.memory_stack[-1][1],peak)
+
+def summarize(records):
+    """ aggregates a list of stage records (from any number of images) into per stage count, total and mean times and max peak memory """
+    summary = {}
+    for r in records:
+        s = summary.setdefault(r["stage"],{"stage":r["stage"],"count":0,"wall":0.0,"cpu":0.0,"peak_memory":None})
+        s["count"] += 1
+        s["wall"] += r["wall"]
+        s["cpu"] += r["cpu"]
+        if "peak_memory" in r:
+            s["peak_memory"] = max(s["peak_memory"] or 0,r["peak_memory"])
+
+    for s in summary.values():
+        s["mean_wall"] = s["wall"] / s["count"]
+        s["mean_cpu"] = s["cpu"] / s["count"]
+    return list(summary.values())
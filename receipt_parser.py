@@ -1,167 +1,185 @@
 from re import L
 from parsing.Parsers import ReceiptParser
-from preprocessing.Processors import Eroder,Denoiser,Deskewer,ArtifactRemover,Dilater
-from output.Printers import JsonPrinter
-import cv2 
+from preprocessing.Processors import Eroder,Denoiser,Deskewer,ArtifactRemover,Dilater,MorphologyPipeline,RoiCropper,TextDetector
+from output.Printers import JsonPrinter,JsonlPrinter,ParquetPrinter
+from pipeline.Pipelines import Pipeline,loadImage
+from pipeline.TieredPipelines import TieredPipeline,DateFound,TotalMatchesItems,MinConfidence
+from cache.Caches import ResultCache
+from evaluation.Metrics import evaluateReceipt
+from ingestion.Manifests import iterInputs,Manifest
+from profiling.Profilers import Profiler,summarize
+from common.Lazy import lazyImport
+import cProfile
+import csv
+import collections
+import contextlib
+import hashlib
 import sys
 import os
 import ntpath
-import numpy as np
 import json 
-import math 
+import time
+import multiprocessing
 
-def parseReceipt(path,outPath):
-    img = cv2.imread(path,0)     
+# only loaded by the modes which use them, keeping the start up of single receipt runs short
+cv2 = lazyImport("cv2")
+Servers = lazyImport("service.Servers")
+Sweeps = lazyImport("calibration.Sweeps")
 
+def buildPipeline(options):
+    """ builds the default pre-processing and parsing pipeline, options is a dictionary of the command line settings """
     pre_processors=[
-        Denoiser(lo_intensity_thresh=140),
+        RoiCropper(copy=options.get("memory_budget") is None),
+        Denoiser(lo_intensity_thresh=140,adaptive=options.get("adaptive_denoise",False)),
         ArtifactRemover(text_area_frac_threshold_lo=0.0001,text_area_frac_threshold_hi=0.6),
         Deskewer(text_area_frac_threshold=0.03),
-        Dilater(iterations=2,kernel_shape=(2,2)),
-        Eroder(iterations=2,kernel_shape=(2,2)),
-        Dilater(iterations=2,kernel_shape=(2,2)),
-
+        MorphologyPipeline([
+            Dilater(iterations=2,kernel_shape=(2,2)),
+            Eroder(iterations=2,kernel_shape=(2,2)),
+            Dilater(iterations=2,kernel_shape=(2,2)),
+        ]),
         ]
 
-    if img is None:
-        print("Could not find input image at:" + path)
-        sys.exit(1)
+    cache = None
+    if options.get("cache_dir") is not None:
+        cache = ResultCache(options["cache_dir"],max_bytes=options.get("cache_size",1024) * 1024 ** 2)
 
-    for p in pre_processors:
-        img = p.process(img)  
+    bands = options.get("ocr_bands",0)
+    parser = ReceiptParser(reuse_ocr=options.get("reuse_ocr",False),line_bands=bands > 0,band_workers=max(bands,1))
+    full = Pipeline(pre_processors,parser,cache,memory_budget=options.get("memory_budget"))
+    if not options.get("tiered",False):
+        return full
 
-    cv2.imwrite(os.path.splitext(outPath)[0]+".png",img)
-    
-    receipt = parser.parseReceipt(img)
+    # OCR of the raw image, only receipts which don't look right get the full pre-processing
+    raw = Pipeline([TextDetector()],ReceiptParser(reuse_ocr=True),cache)
+    validators = [DateFound(),TotalMatchesItems(tolerance=options.get("total_tolerance",0.02)),MinConfidence(threshold=options.get("min_confidence",70))]
+    return TieredPipeline([raw,full],validators,["raw","full"])
+
+def parseReceipt(path,outPath,write_output=True):
+    """ parses the image at path and writes the receipt to outPath, unless write_output is False (when the caller streams the outputs), returns the receipt """
+    img = loadImage(path,mmap=map_inputs)
+
+    img,receipt = pipeline.run(img)
+
+    # the pre-processed image is only written next to the output when asked for
+    if debug_images:
+        cv2.imwrite(os.path.splitext(outPath)[0]+".png",img)
     
-    f = open(outPath,"w")
-    printer.printOutput(receipt,f)
+    if write_output:
+        with open(outPath,"w") as f:
+            printer.printOutput(receipt,f)
+    return receipt
 
 
-def word_distance(seq1,seq2):
-    """ the error metric in analytics mode for comparing expected output to actual 
-        https://stackabuse.com/levenshtein-distance-and-text-similarity-in-python/
+def initWorker(options):
+    """ builds the pipeline and printer once per bulk mode worker process """
+    global pipeline, printer, debug_images, worker_cprofile, map_inputs
+    pipeline = buildPipeline(options)
+    printer = JsonPrinter()
+    debug_images = options.get("debug_images",False)
+    # raw inputs are memory mapped rather than read when running tiled
+    map_inputs = options.get("memory_budget") is not None
+    worker_cprofile = cProfile.Profile() if options.get("cprofile") else None
+
+def processFile(job):
+    """ parses (and in analytics mode analyzes) a single bulk mode input, never raises so one bad image doesn't stop the batch.
+        returns a tuple of the input path, seconds taken, the error message or None on success, the normalized analytics error or None,
+        the list of stage records if profiling or None, the decisions of the adaptive pre-processors
+        and the receipt if the outputs are streamed by the main process (any output format but json) or None
     """
-    size_x = len(seq1) + 1
-    size_y = len(seq2) + 1
-    matrix = np.zeros ((size_x, size_y))
-    for x in range(size_x):
-        matrix [x, 0] = x
-    for y in range(size_y):
-        matrix [0, y] = y
-
-    for x in range(1, size_x):
-        for y in range(1, size_y):
-            if seq1[x-1] == seq2[y-1]:
-                matrix [x,y] = min(
-                    matrix[x-1, y] + 1,
-                    matrix[x-1, y-1],
-                    matrix[x, y-1] + 1
-                )
-            else:
-                matrix [x,y] = min(
-                    matrix[x-1,y] + 1,
-                    matrix[x-1,y-1] + 1,
-                    matrix[x,y-1] + 1
-                )
-    return (matrix[size_x - 1, size_y - 1])
-
-def normalized_error(total_distance,total_label_characters):
-    return total_distance / (total_label_characters + 1)
-
-
-# utility for nested dictionary val extraction
-def json_leaf_strings(json,leafs):
-    for v in json.values():
-        if isinstance(v,dict):
-            json_leaf_strings(v,leafs)
-        elif isinstance(v,list):
-            for i in v:
-                json_leaf_strings(i,leafs)
-        else:
-            leafs.append(v)
-                
-    return leafs
-
-def analyzeResults(input_filepath,output_directory, label_directory, results_directory):
+    path, out_path, label_directory, results_directory, options = job
+    start = time.perf_counter()
+    normalized_error = None
+    profiler = Profiler(track_memory=options.get("profile_memory",False)) if options.get("profile") else None
+    error = None
+    report = {}
+    streamed = None
+    streaming = options.get("output_format","json") != "json"
+
+    if options.get("cprofile"):
+        worker_cprofile.enable()
+    try:
+        with (profiler.activated() if profiler else contextlib.nullcontext()):
+            if not streaming or debug_images:
+                os.makedirs(os.path.dirname(out_path) or ".",exist_ok=True)
+            receipt = parseReceipt(path,out_path,write_output=not streaming)
+            report = dict(pipeline.last_report)
+            if streaming:
+                receipt.source = path
+                streamed = receipt
+            if label_directory is not None:
+                os.makedirs(results_directory,exist_ok=True)
+                result = analyzeResults(path,os.path.dirname(out_path),label_directory,results_directory,options.get("matching","greedy"),report,
+                    printer.toDict(receipt) if streaming else None)
+                normalized_error = result["normalized_total_error"]
+    except Exception as e:
+        error = type(e).__name__ + ": " + str(e)
+    finally:
+        if options.get("cprofile"):
+            worker_cprofile.disable()
+            # dumped after every file so the stats survive killed runs, one file per worker process
+            worker_cprofile.dump_stats("{}.{}".format(options["cprofile"],os.getpid()))
+
+    return (path, time.perf_counter() - start, error, normalized_error, profiler.records if profiler else None, report, streamed)
+
+def runBulk(jobs,workers,options):
+    """ runs the jobs across a pool of workers, yielding results in the same order as the jobs.
+        jobs can be a generator, it is consumed lazily keeping only a few jobs per worker in flight
+    """
+    if workers == 1:
+        initWorker(options)
+        for job in jobs:
+            yield processFile(job)
+    else:
+        with multiprocessing.Pool(workers,initializer=initWorker,initargs=(options,)) as pool:
+            in_flight = collections.deque()
+            for job in jobs:
+                in_flight.append(pool.apply_async(processFile,(job,)))
+                if len(in_flight) >= 4 * workers:
+                    yield in_flight.popleft().get()
+
+            while len(in_flight) > 0:
+                yield in_flight.popleft().get()
+
+def writeProfileReport(path,records):
+    """ writes the stage records as a json list, or as csv if the path ends with .csv """
+    if path.endswith(".csv"):
+        # annotations (e.g. the denoiser's decision) become extra columns
+        fields = ["file","stage","depth","wall","cpu","peak_memory"]
+        fields += sorted(set(k for r in records for k in r if k not in fields))
+        with open(path,"w",newline="") as f:
+            writer = csv.DictWriter(f,fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(path,"w") as f:
+            json.dump(records,f,indent=4)
+
+def popOption(argv,name,default=None):
+    """ removes the option and its value from argv and returns the value, or the default if not present """
+    if name not in argv:
+        return default
+    idx = argv.index(name)
+    value = argv[idx + 1]
+    del argv[idx:idx + 2]
+    return value
+
+def analyzeResults(input_filepath,output_directory, label_directory, results_directory, matching="greedy", report=None, output_data=None):
         # input will be a png input file
         basename = ntpath.basename(input_filepath).split(".")[0]
         label_data = json.load(open(os.path.join(label_directory,basename + ".json"),"r"))
-        output_data = json.load(open(os.path.join(output_directory,basename + ".json"),"r"))
-        # analysis results
-        result_data_path = results_directory
-
-
-        day_dist = word_distance(label_data["day"],output_data["day"])
-        month_dist = word_distance(label_data["month"],output_data["month"])
-        year_dist = word_distance(label_data["year"],output_data["year"])
-        total_w_dist = word_distance(label_data["total_whole_part"],output_data["total_whole_part"])
-        total_f_dist = word_distance(label_data["total_fractional_part"],output_data["total_fractional_part"])
-
-        # match items based on word distance between label and output
-        assignment = []
-        assigned = set()
-        for correct in label_data["items"]:
-
-            min_output = None
-            min_distance = math.inf
-
-            for output in output_data["items"]:
-                # don't assign more than once
-                if output["name"] in assigned:
-                    continue 
-
-                # pick output best matching correct output by name of product
-                distance = word_distance(correct["name"],output["name"])
-                if distance < min_distance:
-                    min_output = output
-                    min_distance = distance
-
-            if min_output is not None:
-                assignment.append((correct,min_output))
-                assigned.add(min_output["name"])
-            else: 
-                # no matching found
-                assignment.append((correct,None)) 
-        
-        # compare based on this matching
-        items_distance = 0
-        for label_output_pair in assignment:
-            label = label_output_pair[0]
-            output = label_output_pair[-1]
-
-            # if label is assigned to an output
-            if output is not None:
-                # count distances
-                items_distance += word_distance(label["name"],output["name"])
-                items_distance += word_distance(label["price_whole_part"],output["price_whole_part"])
-                items_distance += word_distance(label["price_fractional_part"],output["price_fractional_part"])
-            else:
-                # add length of missed item and its fields to item distance
-                items_distance += len(label["name"]) + len(label["price_whole_part"]) + len(label["price_fractional_part"])
-
-        # now penalize additional found items, by adding their lengths to items distance
-        for item in output_data["items"]:
-            # skip assigned items which we compared above
-            if item["name"] in assigned:
-                continue 
-            else:
-                items_distance += len(item["name"] or "") + len(item["price_whole_part"] or "") + len(item["price_fractional_part"] or "")
+        # the output is read back from its file unless given (i.e. when outputs are streamed)
+        if output_data is None:
+            output_data = json.load(open(os.path.join(output_directory,basename + ".json"),"r"))
 
         # output the data to argument 4
-        chars_in_output = sum([len(x) for x in json_leaf_strings(label_data,[])])
-        total_error = day_dist + month_dist + year_dist + total_w_dist + total_f_dist + items_distance
-        result = {
-            "date_dist":day_dist + month_dist + year_dist,
-            "total_dist": total_w_dist + total_f_dist,
-            "item_dist": items_distance,
-            "total_word_distance": total_error,
-            "total_characters_label": chars_in_output,
-            "normalized_total_error": normalized_error(total_error,chars_in_output)
-        }
-
-        out = open(os.path.join(result_data_path,basename + ".json"),"w")
+        result = evaluateReceipt(label_data,output_data,matching)
+        # keep the decisions of the adaptive pre-processors next to the error they led to
+        if report:
+            result["decisions"] = report
+        out = open(os.path.join(results_directory,basename + ".json"),"w")
         json.dump(result,out,indent=4)
+        return result
     
 
 if __name__ == "__main__":
@@ -175,51 +193,267 @@ if __name__ == "__main__":
     # and will output score metrics in second additional argument directory
     analytics_mode = "-a" in sys.argv
 
+    # parse the text found while removing artifacts instead of running OCR a second time
+    reuse_ocr = "--reuse-ocr" in sys.argv
+
     if bulk_mode:
         sys.argv.remove("-b")
     if analytics_mode:
         sys.argv.remove("-a")
+    if reuse_ocr:
+        sys.argv.remove("--reuse-ocr")
+
+    # directory of the on disk stage cache and its size limit in MB, no caching is done without a directory
+    cache_dir = popOption(sys.argv,"--cache")
+    cache_size = int(popOption(sys.argv,"--cache-size",1024))
+
+    # how analytics mode matches labelled items to parsed ones, greedy or optimal
+    matching = popOption(sys.argv,"--matching","greedy")
+
+    # recognize the lines of text of each receipt separately on the given number of threads, 0 recognizes the whole receipt at once
+    ocr_bands = int(popOption(sys.argv,"--ocr-bands",0))
+
+    # estimate the noise of each image and only denoise as much as needed
+    adaptive_denoise = "--adaptive-denoise" in sys.argv
+    if adaptive_denoise:
+        sys.argv.remove("--adaptive-denoise")
+
+    # try parsing the raw image first and only fall back to the full pipeline if the receipt fails validation
+    tiered = "--tiered" in sys.argv
+    if tiered:
+        sys.argv.remove("--tiered")
+    min_confidence = float(popOption(sys.argv,"--min-confidence",70))
+
+    # bulk mode writes a pretty printed json file per input (json) or streams every receipt into a single jsonl or parquet file in the output directory
+    output_format = popOption(sys.argv,"--output-format","json")
+    if output_format not in ("json","jsonl","parquet"):
+        print("unknown output format: " + output_format)
+        sys.exit(1)
 
-
-    parser = ReceiptParser()
-    printer = JsonPrinter()
-
-
-    if bulk_mode or analytics_mode:
+    # run the pixel-local pre-processors on strips of the image using roughly this many MB at once, and memory map raw (.npy and .pgm) inputs
+    memory_budget = popOption(sys.argv,"--memory-budget")
+
+    options = {"memory_budget":int(float(memory_budget) * 1024 ** 2) if memory_budget is not None else None,"output_format":output_format,"reuse_ocr":reuse_ocr,"cache_dir":cache_dir,"cache_size":cache_size,"matching":matching,"ocr_bands":ocr_bands,
+        "adaptive_denoise":adaptive_denoise,"tiered":tiered,"min_confidence":min_confidence}
+
+
+    # write per stage wall time, cpu time (and peak memory with --profile-memory) of every file to the given json or csv report
+    profile = popOption(sys.argv,"--profile")
+    profile_memory = "--profile-memory" in sys.argv
+    if profile_memory:
+        sys.argv.remove("--profile-memory")
+    # dump cProfile stats of each worker to <path>.<pid>
+    cprofile = popOption(sys.argv,"--cprofile")
+    options["profile"] = profile
+    options["profile_memory"] = profile_memory
+    options["cprofile"] = cprofile
+
+    # write the pre-processed images next to the outputs
+    debug_images = "--debug-images" in sys.argv
+    if debug_images:
+        sys.argv.remove("--debug-images")
+    options["debug_images"] = debug_images
+
+    # reprocess every input even if the manifest says its output is up to date
+    force = "--force" in sys.argv
+    if force:
+        sys.argv.remove("--force")
+
+    # number of processes used in bulk mode, 0 uses all available cores
+    workers = int(popOption(sys.argv,"--workers",1))
+    if workers <= 0:
+        workers = os.cpu_count()
+
+    # server modes keep warm pipelines around and parse requests over http or newline delimited json on stdin/stdout
+    serve_http = popOption(sys.argv,"--serve-http")
+    serve_stdin = "--serve-stdin" in sys.argv
+    if serve_stdin:
+        sys.argv.remove("--serve-stdin")
+    queue_size = int(popOption(sys.argv,"--queue-size",64))
+
+    # calibration sweep over a json grid of "ClassName.parameter": [values], with --samples N a random search of N configurations instead
+    sweep = popOption(sys.argv,"--sweep")
+    samples = popOption(sys.argv,"--samples")
+    seed = int(popOption(sys.argv,"--seed",0))
+
+    if serve_http is not None or serve_stdin:
+        service = Servers.ReceiptService(lambda: buildPipeline(options),workers=workers,queue_size=queue_size).start()
+        if serve_http is not None:
+            print("serving on http://127.0.0.1:{}".format(serve_http))
+            Servers.serveHttp(service,int(serve_http))
+        else:
+            Servers.serveStdin(service)
+        service.stop()
+
+    elif sweep is not None:
+        dir = sys.argv[1]
+        label_dir = sys.argv[2]
+        sweep_output = sys.argv[3] if len(sys.argv) > 3 else None
+
+        with open(sweep) as f:
+            space = json.load(f)
+        configs = Sweeps.gridConfigs(space) if samples is None else Sweeps.randomConfigs(space,int(samples),seed)
+
+        # the sweep tunes the settings of a single pipeline
+        options["tiered"] = False
+        base = buildPipeline(options)
+        try:
+            tree = Sweeps.StageTree([Sweeps.applyConfig(base,c) for c in configs])
+        except ValueError as e:
+            print("invalid sweep: {}".format(e))
+            sys.exit(1)
+        print("{} configurations, {} pre-processing stages per image instead of {}".format(
+            len(configs),tree.stageCount(),sum(len(p.pre_processors) for p in tree.pipelines)))
+
+        jobs = ((os.path.join(dir,rel),os.path.join(label_dir,os.path.dirname(rel),ntpath.basename(rel).split(".")[0] + ".json"),matching) 
+            for rel in iterInputs(dir))
+        start = time.perf_counter()
+        scores = []
+        failed = []
+        for (f,error,image_scores) in Sweeps.runSweep(jobs,configs,buildPipeline,options,workers):
+            if error is None:
+                scores.append(image_scores)
+                print("{}: done".format(f))
+            else:
+                failed.append(f)
+                print("{}: failed ({})".format(f,error))
+        print("evaluated {} configurations on {} files ({} failed) in {:.2f}s using {} worker(s)".format(
+            len(configs),len(scores),len(failed),time.perf_counter() - start,workers))
+
+        table = Sweeps.rankConfigs(configs,scores)
+        print("{:>4} {:>10} {:>10}  configuration".format("rank","error","seconds"))
+        for row in table:
+            if row["mean_error"] is not None:
+                print("{:>4} {:>10.4f} {:>10.3f}  {}".format(row["rank"],row["mean_error"],row["mean_seconds"],json.dumps(row["config"])))
+
+        if sweep_output is not None:
+            with open(sweep_output,"w") as f:
+                json.dump(table,f,indent=4)
+
+    elif bulk_mode or analytics_mode:
         dir = sys.argv[1]  
         out_dir = sys.argv[2]
-        files = [os.path.join(dir,f) for f in os.listdir(dir) if os.path.isfile(os.path.join(dir,f))]
-
-        for f in files:
-            basename = ntpath.basename(f)
-            out_path = os.path.join(out_dir,basename.split(".")[0] + ".json")
-            parseReceipt(f,out_path)
+        label_dir = sys.argv[3] if analytics_mode else None
+        result_directory = sys.argv[4] if analytics_mode else None
+
+        # inputs which are already up to date according to the checkpoint manifest of a previous run are skipped
+        fingerprint = hashlib.sha256((buildPipeline(options).fingerprint() + "|" + matching).encode()).hexdigest()[:16]
+        manifest = Manifest(os.path.join(out_dir,".manifest.jsonl"))
+
+        # streamed outputs are written by this process as the results come in, jsonl is appended to so skipped inputs keep their lines
+        # (an input processed again gets a new line, the last line of a source is the current one), parquet files can't be appended to so everything is reprocessed
+        stream_printer = None
+        stream_path = None
+        if output_format == "jsonl":
+            stream_path = os.path.join(out_dir,"receipts.jsonl")
+            stream_printer = JsonlPrinter(stream_path)
+        elif output_format == "parquet":
+            stream_path = os.path.join(out_dir,"receipts.parquet")
+            try:
+                stream_printer = ParquetPrinter(stream_path)
+            except ImportError:
+                print("parquet output needs the pyarrow package: pip install pyarrow")
+                sys.exit(1)
+            force = True
+        stats = {"skipped":0,"error_sum":0,"error_count":0}
+        # number of files and their error sum per decision of the adaptive pre-processors, e.g. ("denoise","skip")
+        decisions = {}
+
+        def jobs():
+            """ lazily yields a job per input which isn't up to date, in sorted order so runs are deterministic """
+            for rel in iterInputs(dir):
+                rel_dir = os.path.dirname(rel)
+                path = os.path.join(dir,rel)
+                out_path = os.path.join(out_dir,rel_dir,ntpath.basename(rel).split(".")[0] + ".json")
+
+                record = None if force else manifest.upToDate(rel,path,stream_path or out_path,fingerprint,needs_error=analytics_mode)
+                if record is not None:
+                    stats["skipped"] += 1
+                    if analytics_mode:
+                        stats["error_sum"] += record["error"]
+                        stats["error_count"] += 1
+                    continue
+
+                yield (path,out_path,
+                    os.path.join(label_dir,rel_dir) if analytics_mode else None,
+                    os.path.join(result_directory,rel_dir) if analytics_mode else None,
+                    options)
+
+        start = time.perf_counter()
+        succeeded = 0
+        failed = []
+        profile_records = []
+        for (f,seconds,error,normalized_error,records,report,receipt) in runBulk(jobs(),workers,options):
+            if records is not None:
+                profile_records.extend([dict(r,file=f) for r in records])
+
+            if error is None:
+                succeeded += 1
+                if stream_printer is not None:
+                    stream_printer.printOutput(receipt)
+                manifest.record(os.path.relpath(f,dir),f,fingerprint,normalized_error)
+                # running sum of the analytics error, so no second pass over the results is needed
+                if normalized_error is not None:
+                    stats["error_sum"] += normalized_error
+                    stats["error_count"] += 1
+                for key,value in report.items():
+                    if isinstance(value,str):
+                        d = decisions.setdefault((key,value),{"count":0,"error_sum":0,"error_count":0})
+                        d["count"] += 1
+                        if normalized_error is not None:
+                            d["error_sum"] += normalized_error
+                            d["error_count"] += 1
+                print("{}: {:.2f}s".format(f,seconds))
+            else:
+                failed.append(f)
+                print("{}: failed after {:.2f}s ({})".format(f,seconds,error))
+        elapsed = time.perf_counter() - start
+        if stream_printer is not None:
+            stream_printer.close()
+        manifest.close()
+
+        processed = succeeded + len(failed)
+        print("processed {} files ({} failed, {} up to date and skipped) in {:.2f}s using {} worker(s), {:.2f} files/s".format(
+            processed,len(failed),stats["skipped"],elapsed,workers,processed / elapsed if elapsed > 0 else 0))
+
+        if profile is not None:
+            writeProfileReport(profile,profile_records)
+            print("stage timings (mean wall/cpu seconds per call):")
+            for s in summarize(profile_records):
+                print("  {:<28} {:>6} calls {:>9.4f}s {:>9.4f}s".format(s["stage"],s["count"],s["mean_wall"],s["mean_cpu"]))
+
+        if len(decisions) > 0:
+            print("adaptive pipeline decisions:")
+            for (key,value),d in sorted(decisions.items()):
+                mean_error = " mean error {:.4f}".format(d["error_sum"] / d["error_count"]) if d["error_count"] > 0 else ""
+                print("  {} {:<12} {:>6} files{}".format(key,value,d["count"],mean_error))
 
-            # additionally calculate error metrics
-            if analytics_mode:
-                analyzeResults(f,out_dir,sys.argv[3],sys.argv[4])
-        
         # collate total error metric
-        if analytics_mode:
-            result_directory = sys.argv[4]
-
-            average_error = 0
-            for f in files:
-                basename = ntpath.basename(f)
-                result_file_path = os.path.join(sys.argv[4],basename.split(".")[0] + ".json")
-
-                result = json.load(open(result_file_path,"r"))
-
-                average_error += result["normalized_total_error"]
-
-            average_error = average_error / len(files)
+        if analytics_mode and stats["error_count"] > 0:
+            average_error = stats["error_sum"] / stats["error_count"]
             print("the average normalized error is: " + str(average_error))
             # write to collated file
             collated_result_file = open(os.path.join(result_directory,"total.json"),"w")
             json.dump({"average_error":average_error},collated_result_file)
 
+        if len(failed) > 0:
+            sys.exit(1)
+
     else:
         input = sys.argv[1]
         output = sys.argv[2]
-        parseReceipt(input,output)
-
+        initWorker(options)
+        profiler = Profiler(track_memory=profile_memory) if profile else None
+        try:
+            with (profiler.activated() if profiler else contextlib.nullcontext()):
+                if cprofile:
+                    worker_cprofile.runcall(parseReceipt,input,output)
+                    worker_cprofile.dump_stats(cprofile)
+                else:
+                    parseReceipt(input,output)
+        except IOError as e:
+            print(e)
+            sys.exit(1)
+
+        if profiler is not None:
+            writeProfileReport(profile,[dict(r,file=input) for r in profiler.records])
@@ -0,0 +1,250 @@
+import threading
+import queue
+import collections
+import concurrent.futures
+import time
+import json
+import base64
+import sys
+from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+from output.Printers import JsonPrinter
+
+class ServiceBusy(Exception):
+    """ raised when a request can't be queued because the queue is full """
+    pass
+
+class ReceiptService():
+    """
+    Keeps a number of worker threads, each with its own warm pipeline (built once by the factory), 
+    processing parse requests from a bounded queue. OpenCV and tesseract release the GIL so the threads run in parallel.
+    """
+    def __init__(self,pipeline_factory,workers=2,queue_size=64,latency_window=1000):
+        """ pipeline_factory is called once per worker thread and returns the Pipeline it uses, 
+            queue_size bounds the number of waiting requests, latency percentiles are taken over the last latency_window requests 
+        """
+        self.pipeline_factory = pipeline_factory
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.printer = JsonPrinter()
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.counts = {"processed":0,"failed":0,"rejected":0}
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        for _ in range(self.workers):
+            t = threading.Thread(target=self.work,daemon=True)
+            t.start()
+            self.threads.append(t)
+        return self
+
+    def stop(self):
+        """ finishes the queued requests and stops the workers """
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def work(self):
+        pipeline = self.pipeline_factory()
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+
+            (source,future,queued_at) = request
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            with self.lock:
+                self.in_flight += 1
+            try:
+                result = self.printer.toDict(pipeline.parse(source))
+                future.set_result(result)
+                failed = False
+            except Exception as e:
+                future.set_exception(e)
+                failed = True
+
+            with self.lock:
+                self.in_flight -= 1
+                self.counts["failed" if failed else "processed"] += 1
+                self.latencies.append(time.perf_counter() - queued_at)
+
+    def submit(self,source,block=False):
+        """ queues the source (anything Pipeline.parse accepts) and returns a future of the receipt's json dictionary, 
+            raises ServiceBusy if the queue is full, unless block is set in which case it waits for space
+        """
+        future = concurrent.futures.Future()
+        try:
+            self.queue.put((source,future,time.perf_counter()),block=block)
+        except queue.Full:
+            with self.lock:
+                self.counts["rejected"] += 1
+            raise ServiceBusy("queue is full ({} requests waiting)".format(self.queue.maxsize))
+        return future
+
+    def freeSlots(self):
+        return self.queue.maxsize - self.queue.qsize()
+
+    def parseBatch(self,requests,timeout=None):
+        """ parses a batch of requests, each a dictionary with an optional "id" and either a "path" or base64 encoded image "data",
+            returns a result dictionary per request with the id and either the "receipt" or an "error"
+        """
+        futures = []
+        for r in requests:
+            try:
+                futures.append(self.submit(decodeSource(r)))
+            except Exception as e:
+                futures.append(e)
+
+        results = []
+        for r,f in zip(requests,futures):
+            result = {"id":r.get("id") if isinstance(r,dict) else None}
+            try:
+                if isinstance(f,Exception):
+                    raise f
+                result["receipt"] = f.result(timeout)
+            except Exception as e:
+                result["error"] = type(e).__name__ + ": " + str(e)
+            results.append(result)
+        return results
+
+    def stats(self):
+        """ current queue depth, requests in flight, request counts and latency percentiles (in ms, from queueing to completion) """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = dict(self.counts,queue_depth=self.queue.qsize(),in_flight=self.in_flight)
+
+        def percentile(p):
+            if len(latencies) == 0:
+                return None
+            return latencies[min(len(latencies) - 1,int(p / 100 * len(latencies)))] * 1000
+
+        stats["latency_ms"] = {"p50":percentile(50),"p90":percentile(90),"p99":percentile(99),"max":percentile(100)}
+        return stats
+
+def decodeSource(request):
+    """ the image source of a json request, a path or the decoded bytes of base64 "data" """
+    if not isinstance(request,dict):
+        raise ValueError("request needs to be a json object")
+    if "data" in request:
+        return base64.b64decode(request["data"])
+    if "path" in request:
+        return request["path"]
+    raise ValueError("request needs either a path or base64 encoded image data")
+
+def makeHandler(service):
+    """ builds the http request handler class serving the given service """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def reply(self,status,body,headers={}):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type","application/json")
+            self.send_header("Content-Length",str(len(data)))
+            for k,v in headers.items():
+                self.send_header(k,v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.reply(200,service.stats())
+            else:
+                self.reply(404,{"error":"unknown endpoint"})
+
+        def do_POST(self):
+            if self.path != "/parse":
+                self.reply(404,{"error":"unknown endpoint"})
+                return
+
+            body = self.rfile.read(int(self.headers.get("Content-Length",0)))
+
+            # raw image bodies are a batch of one, anything else is a json batch
+            if self.headers.get("Content-Type","").startswith("image/"):
+                requests = [{"data":base64.b64encode(body).decode()}]
+            else:
+                try:
+                    requests = json.loads(body)["images"]
+                except (ValueError,KeyError,TypeError):
+                    requests = None
+                if not isinstance(requests,list) or not all(isinstance(r,dict) for r in requests):
+                    self.reply(400,{"error":"expected a json body with a list of image objects, {\"images\":[{\"id\":..,\"path\":..},..]}"})
+                    return
+
+            if len(requests) > service.queue.maxsize:
+                self.reply(413,{"error":"batch larger than the queue size ({})".format(service.queue.maxsize)})
+                return
+
+            # apply backpressure to whole batches, so clients can retry them as one
+            if service.freeSlots() < len(requests):
+                with service.lock:
+                    service.counts["rejected"] += len(requests)
+                self.reply(503,{"error":"busy, queue is full"},{"Retry-After":"1"})
+                return
+
+            self.reply(200,{"results":service.parseBatch(requests)})
+
+        def log_message(self,format,*args):
+            # requests are counted in the stats rather than logged
+            pass
+
+    return Handler
+
+def serveHttp(service,port,host="127.0.0.1"):
+    """ serves the service over http until interrupted: POST /parse with {"images":[{"id":..,"path":..} or {"id":..,"data":base64}]} 
+        or a raw image body, GET /stats for the queue depth and latency percentiles
+    """
+    server = ThreadingHTTPServer((host,port),makeHandler(service))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def serveStdin(service,input=sys.stdin,output=sys.stdout):
+    """ serves newline delimited json requests from input until it closes, writing a json line per result to output as they complete.
+        A request is {"id":..,"path":..} or {"id":..,"data":base64}, or {"id":..,"stats":true} for the service stats.
+        Reading blocks while the queue is full, pushing the backpressure onto the writer
+    """
+    write_lock = threading.Lock()
+    pending = []
+
+    def write(result):
+        with write_lock:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    def done(request_id,future):
+        try:
+            write({"id":request_id,"receipt":future.result()})
+        except Exception as e:
+            write({"id":request_id,"error":type(e).__name__ + ": " + str(e)})
+
+    for line in input:
+        if line.strip() == "":
+            continue
+        request = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request,dict):
+                raise ValueError("request needs to be a json object")
+            if request.get("stats"):
+                write({"id":request.get("id"),"stats":service.stats()})
+                continue
+            future = service.submit(decodeSource(request),block=True)
+        except Exception as e:
+            write({"id":request.get("id") if isinstance(request,dict) else None,"error":type(e).__name__ + ": " + str(e)})
+            continue
+
+        future.add_done_callback(lambda f,request_id=request.get("id"): done(request_id,f))
+        pending.append(future)
+        if len(pending) > 1000:
+            pending = [f for f in pending if not f.done()]
+
+    concurrent.futures.wait(pending)